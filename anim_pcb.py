@@ -1,11 +1,12 @@
 #!/usr/bin/python3
 
-import argparse, math, os.path, pathlib
-import shlex, sys, subprocess, time
-from dataclasses import dataclass, field
+import argparse, array, bisect, collections, csv, hashlib, heapq, http.server, json, math, os.path, pathlib
+import queue, re, selectors, shlex, shutil, signal, socket, struct, sys, subprocess
+import logging, threading, time, urllib.error, urllib.request, zlib
+from dataclasses import dataclass, field, replace
 
 #***** Global variables ********************************************************
-global glob 	# Instantiate to a Globals in main
+global glob 	# The current Globals, see glob_switch()
 #***** Classes *****************************************************************
 
 # ANSI-sequences for text styles and colours when print()ing in terminal.
@@ -29,6 +30,33 @@ class term:
 	extra =					normal + grey
 # /class term
 
+TERM_RE = re.compile(r'\033\[[0-9;]*m')	# any of the above, removed with --nocolor
+
+
+# Names of the interpolated pose parameters, SegmentSpec has fr_<name> and to_<name>.
+POSE_COLS = ("zoom", "rotax", "rotay", "rotaz", "panax", "panay", "panaz",
+				"pivx", "pivy", "pivz")
+ROT_COLS = ("rotax", "rotay", "rotaz")
+
+# Named easing curves, as cubic bezier control points like CSS timing functions.
+EASE_CURVES = {
+	"linear":	None,
+	"in":		(0.42, 0, 1, 1),
+	"out":		(0, 0, 0.58, 1),
+	"inout":	(0.42, 0, 0.58, 1),
+	"cubic":	(0.65, 0, 0.35, 1),
+}
+
+# --encoder profiles: ffmpeg codec, preset option and default, default CRF,
+# pixel formats without and with --alpha, how two-pass stats are kept.
+ENC_PROFILES = {
+	"x264":		("libx264",		("-preset", "slow"),	22,		"yuv420p",		None,			"pass"),
+	"x265":		("libx265",		("-preset", "medium"),	26,		"yuv420p",		None,			"x265-params"),
+	"vp9":		("libvpx-vp9",	("-cpu-used", "2"),		32,		"yuv420p",		"yuva420p",		"pass"),
+	"av1":		("libsvtav1",	("-preset", "8"),		35,		"yuv420p",		None,			None),
+	"prores":	("prores_ks",	None,					None,	"yuv422p10le",	"yuva444p10le",	None),
+}
+
 
 # One instance for each "--segment" argument given on the commandline. Must
 # contain all data necessary for 3D transition between frames within that segment.
@@ -64,7 +92,7 @@ class SegmentSpec:
 	to_pivy:	float	=	0
 	to_pivz:	float	=	0
 
-	d_zoom:		float	=	0
+	d_zoom:		float	=	0	# d_*: approximate step per frame, for display
 	d_rotax:	float	=	0
 	d_rotay:	float	=	0
 	d_rotaz:	float	=	0
@@ -74,9 +102,116 @@ class SegmentSpec:
 	d_pivx:		float	=	0
 	d_pivy:		float	=	0
 	d_pivz:		float	=	0
+
+	ease:		tuple	=	None	# (x1, y1, x2, y2) of a cubic bezier easing curve, or None
+	rot_short:	bool	=	False	# rotate the shortest way between poses
+	keys:		list[tuple]	=	field(default_factory=list)	# poses between fr_ and to_, in POSE_COLS order
 # /class SegmentSpec
 
 
+# Pose of every frame of the video, one array per parameter. See frame_table().
+@dataclass(eq=False)
+class FrameTable:
+	seg_index:	array.array	=	field(default_factory=lambda: array.array("i"))
+	cols:		dict[str, array.array]	=	field(
+					default_factory=lambda: {c: array.array("d") for c in POSE_COLS})
+
+	def __len__(self) -> int:
+		return len(self.seg_index)
+
+	def pose(self, i: int) -> tuple:
+		return tuple(self.cols[c][i] for c in POSE_COLS)
+# /class FrameTable
+
+
+# Frame plan of the whole video, built before anything is rendered. The poses
+# stay in the columns of table, per frame only its row and group are kept.
+# Frames with identical kicad-cli args share a group, rendered once, whose args
+# are only built when needed: its pose args, then the args all frames share.
+@dataclass(eq=False)
+class RenderPlan:
+	table:		FrameTable			=	None
+	rows:		array.array			=	field(default_factory=lambda: array.array("i"))	# per frame, row in table
+	seg_index:	array.array			=	field(default_factory=lambda: array.array("i"))	# per frame
+	group:		array.array			=	field(default_factory=lambda: array.array("i"))	# per frame, index in keys
+	keys:		list[str]			=	field(default_factory=list)	# per group, see frame_pose_key()
+	seg_incl:	list[tuple]			=	field(default_factory=list)	# per segment, (incl_pan, incl_piv)
+	static:		list[str]			=	field(default_factory=list)	# see frame_static_args()
+	fps:		int					=	None
+
+	def __len__(self) -> int:
+		return len(self.rows)
+
+	def pose(self, frame: int) -> dict:		# {pose column: value}
+		return dict(zip(POSE_COLS, self.table.pose(self.rows[frame])))
+
+	def argv(self, frame: int) -> list:		# kicad-cli args, all except --output and the input file
+		return self.group_argv(self.group[frame])
+
+	def group_argv(self, group: int) -> list:
+		return ["pcb", "render"] + self.keys[group].split("\0") + self.static
+
+	# Frames of each group. Groups are numbered in the order of their first frame.
+	def groups(self) -> list:
+		frames = [[] for _ in self.keys]
+		for f, g in enumerate(self.group):
+			frames[g].append(f)
+		return frames
+# /class RenderPlan
+
+
+# One unique frame to be rendered locally, and the frames that are copies of it.
+@dataclass(eq=False)
+class FrameJob:
+	group:		int						# kicad-cli args are RenderPlan.group_argv(group)
+	frames:		list[int]				# frames to link to final, frames[0] first
+	partial:	str						# kicad-cli output...
+	final:		str						# ... moved here when complete
+	what:		str			=	"rendering "	# for the log
+	tries:		int			=	0
+	tile_files:	list[str]	=	None	# with --tiles, see tile_expand()
+	tiles_left:	int			=	0
+	tile_fail:	object		=	None	# a failed tile's process
+	tile_t0:	float		=	None
+# /class FrameJob
+
+
+# One unique frame to be rendered by a worker in distributed mode.
+@dataclass(eq=False)
+class RemoteJob:
+	id:			int
+	args:		list[str]				# kicad-cli args, see RenderPlan.argv()
+	partial:	str						# where the coordinator stores the result...
+	final:		str						# ... before moving it here
+	frames:		list[int]				# frames to link to final
+	state:		str			=	"pending"	# pending, assigned, done, failed
+	tries:		int			=	0
+	worker:		str			=	None
+# /class RemoteJob
+
+
+# One frame being rendered by a renderer server, see server_submit(). Kept in
+# proc_list in place of a kicad-cli process, with the attributes the scheduler
+# and the on_exit callbacks use.
+@dataclass(eq=False)
+class ServerTask:
+	server:		subprocess.Popen
+	on_exit:	object					# called with the task when done
+	glob:		object					# Globals of the batch job it's for
+	t_start:	float
+	deadline:	float		=	None
+	timed_out:	bool		=	False
+	job:		FrameJob	=	None
+	returncode:	int			=	None
+	rusage:		object		=	None	# not known for a frame rendered by a server
+	t_end:		float		=	None
+	errtext:	str			=	""
+
+	def kill(self) -> None:				# The server is replaced by a new one.
+		proc_kill(self.server)
+# /class ServerTask
+
+
 # Global variables kept in a class both to isolate their namespace and for aesthetics.
 @dataclass(eq=False)
 class Globals:
@@ -91,7 +226,18 @@ class Globals:
 	kc_preset:		str			=	None
 	kc_quality:		str			=	None
 	kicad_cli_exe:	str			=	None
-	nocolor:		bool		=	None
+	kicad_cli_cmd:	list[str]	=	None	# kicad_cli_exe, or the stand-in renderer
+	backend:		str			=	None	# exec: a kicad-cli per frame, server: see server_start()
+	server_cmd:		list[str]	=	None	# renderer server command line, or None
+	bench_backends:	bool		=	None
+	stage_dir:		str			=	None	# where to stage the board and its models, or None
+	tiles:			int			=	None	# render frames as tiles x tiles tiles, 1 for whole
+	tile_span:		tuple		=	None	# --pan change moving the view by one frame at zoom 1
+	interp:			int			=	None	# render every Nth frame, synthesize the others
+	interp_mode:	str			=	None	# minterpolate mi_mode
+	interp_max:		float		=	None	# motion between keyframes above which all are rendered
+	nocolor:		bool		=	None	# output without the term sequences, see _OUT()
+	log_fn:			object		=	None	# called with each piece of output instead of print()
 	overwrite:		bool		=	None
 	debug_mode:		bool		=	None
 	dry_run:		bool		=	None
@@ -101,10 +247,55 @@ class Globals:
 	img_suffix:		str			=	None
 	tmp_dir:		str			=	None
 	vid_res:		str			=	None
+	cache_dir:		str			=	None	# None if the frame cache is disabled
+	stream:			bool		=	None
+	resume:			bool		=	None	# trust the journal of an earlier run
+	threads_per_job:int			=	None	# cores per kicad-cli instance
+	pin_cores:		bool		=	None
+	mem_per_job_mb:	int			=	None
+	bench_jobs:		list[int]	=	None	# -j values to benchmark, or None
+	bench_frames:	int			=	None
+	dump_frames:	str			=	None
+	save_plan:		str			=	None	# --save-plan file, or None
+	plan_file:		str			=	None	# --plan file to render, or None
+	plan_given:		object		=	None	# RenderPlan to render, see Renderer.run()
+	preview_every:	int			=	None	# 0, or every Nth frame in the first preview pass
+	preview_scale:	int			=	None	# preview resolution divisor
+	preview_only:	bool		=	None
+	coord_addr:		str			=	None	# host:port to serve frame jobs on, or None
+	worker_addr:	str			=	None	# host:port of coordinator to work for, or None
+	worker_timeout:	float		=	None	# s without heartbeat until a worker is dead
+	retries:		int			=	None
+	retry_backoff:	float		=	None	# s before the first retry, doubled for each next
+	frame_timeout:	float		=	None	# s a kicad-cli may run before it's killed, or None
+	fill_failed:	bool		=	None
+	retry_quarantined:bool		=	None
+	telemetry:		str			=	None	# --telemetry file, or None
+	worker_id:		str			=	None	# host:pid of this worker
+	stream_delete:	bool		=	None
+	disk_budget_mb:	int			=	None	# --disk-budget, or None
+	order:			str			=	None	# --order without :N
+	order_step:		int			=	None	# N of --order interleave:N
+	cache_max_mb:	int			=	None
+	batch_file:		str			=	None	# job file of --batch, or None
+	priority:		float		=	None	# share of the job slots in --batch mode
+	progress:		str			=	None	# frames, tty, log, json or quiet, see progress_tick()
+	progress_every:	float		=	None	# s between progress reports
+	enc_profile:	str			=	None	# key of ENC_PROFILES
+	enc_preset:		str			=	None	# or None for the profile's
+	enc_crf:		int			=	None	# or None for the profile's
+	enc_bitrate:	str			=	None	# ffmpeg -b:v, or None
+	enc_target_mb:	float		=	None	# two-pass to this size, or None
+	enc_gop:		int			=	None	# keyframe interval, or None for ffmpeg's
+	enc_pix_fmt:	str			=	None	# or None for the profile's
+	enc_alpha:		bool		=	None	# keep the transparent background
+	enc_chunks:		str			=	None	# "segments", or number of frame ranges
+	argv:			list[str]	=	None	# command line, without the program name
 
 	# Settings calculated from command line arguments
 	img_base_name:	str					=	None
 	segments:		list[SegmentSpec]	=	field(default_factory=list)
+	plan:			RenderPlan			=	None
 	vid_dx:			int					=	-1	# in pixels
 	vid_dy:			int					=	-1
 	vid_fpms:		float				=	-1	# frames/ms
@@ -112,6 +303,69 @@ class Globals:
 	vid_ms:			float				=	0	# in ms
 	vid_s:			float				=	0	# in s
 
+	# Frame cache. Rendered images are stored under a hash of everything that
+	# affects their content, numbered frame files are links into the cache.
+	pcb_hash:		str			=	None
+	kicad_cli_ver:	str			=	None
+
+	# Staged inputs, see stage_inputs()
+	pcb_render:		str			=	None	# .kicad_pcb given to the renderer
+	stage_path:		str			=	None	# directory of the staged copies, or None
+	cache_used:		set[str]	=	field(default_factory=set)
+	cache_hits:		int			=	0
+	cache_inflight:	dict		=	field(default_factory=dict)	# cache file -> waiting [(Globals, FrameJob)], see cache_wait()
+	cache_waiting:	int			=	0		# FrameJobs of this job in cache_inflight
+
+	# Render journal, see journal_open()
+	journal_file:	object		=	None
+	journal_done:	set[int]	=	field(default_factory=set)	# frames done per journal
+
+	# Streaming encode. ffmpeg reads frames from a pipe in order as soon as the
+	# contiguous prefix of frames is ready, the pipe is written without blocking.
+	stream_proc:	subprocess.Popen	=	None
+	stream_ready:	bytearray	=	None	# per frame, 1 when its file is complete
+	stream_next:	int			=	0		# next frame to be fed
+	stream_buf:		memoryview	=	None	# unwritten part of the frame being fed
+	stream_wait:	bool		=	False	# stdin registered for EVENT_WRITE
+
+	# Distributed rendering, coordinator side. Jobs are handed out by HTTP server
+	# threads, finished jobs are passed to the main thread through coord_done.
+	coord_jobs:		list		=	field(default_factory=list)	# list[RemoteJob]
+	coord_pending:	collections.deque	=	field(default_factory=collections.deque)
+	coord_workers:	dict[str, float]	=	field(default_factory=dict)	# id -> last seen
+	coord_lock:		threading.Lock		=	field(default_factory=threading.Lock)
+	coord_done:		queue.Queue			=	field(default_factory=queue.Queue)
+	coord_server:	http.server.ThreadingHTTPServer	=	None
+	coord_finished:	int					=	0	# jobs taken from coord_done
+	coord_closing:	bool				=	False	# no more jobs will be submitted
+
+	# Telemetry, see telemetry_record()
+	tel_out:		object		=	None
+	tel_csv:		object		=	None	# csv.writer if telemetry is .csv
+	tel_wall:		array.array	=	field(default_factory=lambda: array.array("d"))
+	tel_cpu_sec:	float		=	0
+	tel_rss_kb:		int			=	0
+	tel_slowest:	list		=	field(default_factory=list)	# heap of (wall, frame, pose)
+	tel_start:		float		=	None
+
+	# Frame cost model: wall time of completed renders by frame index, used to
+	# predict the cost of the others. See cost_predict().
+	cost_idx:		list[int]	=	field(default_factory=list)		# sorted
+	cost_sec:		list[float]	=	field(default_factory=list)
+	cost_sorted_at:	int			=	0	# len(cost_idx) when todo was last sorted
+	todo:			list		=	field(default_factory=list)		# FrameJobs not started
+	retry_q:		list		=	field(default_factory=list)		# heap of (time, n, FrameJob)
+	failed_frames:	set[int]	=	field(default_factory=set)		# given up on, this pass
+	quarantine:		dict		=	field(default_factory=dict)	# key -> {"fails", "args", "run"}, see quarantine_load()
+	quarantine_run:	str			=	None	# id of this run in the quarantine
+	eta_at:			float		=	0	# time of last ETA computation
+	eta_every:		float		=	1	# s between ETA computations
+	progress_at:	float		=	0	# time of last progress report
+	tmp_inodes:		dict		=	field(default_factory=dict)	# inode -> [size, frames, cache file], see tmp_track()
+	tmp_bytes:		int			=	0	# of frames waiting to be encoded
+	tmp_peak:		int			=	0
+	disk_deferred:	int			=	0
+
 	# Benchmarking
 	current_sec:	float		=	None
 	elapsed_sec:	float		=	None
@@ -123,23 +377,66 @@ class Globals:
 
 	# List of running processes
 	proc_list:		list[subprocess.Popen] = field(default_factory=list)
+
+	# Scheduler. Children are waited for by blocking in select() on either a
+	# pidfd per child (Linux >= 5.3) or a SIGCHLD wakeup pipe, never by polling.
+	sched_sel:		selectors.BaseSelector	=	None
+	sched_sigfd:	int			=	None	# read end of SIGCHLD wakeup pipe, or None
+	sched_cpu_sec:	float		=	0		# CPU time spent in the scheduler itself
+	sched_t0:		float		=	0		# process_time() when the scheduler was entered
+	sched_jobs:		int			=	0		# number of processes started
+	out_tail:		int			=	16384	# bytes of a process' output kept for error reports
+	core_sets:		list[set]	=	field(default_factory=list)	# for --pin
+	core_use:		list[int]	=	field(default_factory=list)	# processes per core set
+	tile_q:			collections.deque	=	field(default_factory=collections.deque)	# (FrameJob, tile, args)
+
+	# Frame interpolation, see interp_plan()
+	interp_gaps:	list		=	field(default_factory=list)	# (key a, key b, frames between)
+	interp_at:		dict[int, list]	=	field(default_factory=dict)	# key frame -> gaps
+	interp_frames:	set[int]	=	field(default_factory=set)	# frames to be synthesized
+	interp_ready:	bytearray	=	None	# per frame, 1 when its file is complete
+	interp_q:		collections.deque	=	field(default_factory=collections.deque)	# gaps to start
+	interp_started:	set[int]	=	field(default_factory=set)
+	interp_finished:set[int]	=	field(default_factory=set)
+	mem_deferred:	int			=	0		# starts put off for lack of memory
+	servers:		list		=	field(default_factory=list)	# renderer server processes
+
+	# Batch mode. Each job of the job file has a Globals of its own sharing the
+	# scheduler of the main one, see batch_run().
+	batch_index:	int			=	0
+	batch_state:	str			=	None	# render, encode, done
+	batch_failed:	bool		=	False
+	batch_started:	int			=	0		# frames dispatched
 # /class Globals
 
+glob = Globals()
+
 
 #***** Utility functions *******************************************************
 
+def _OUT(txt: str) -> None:
+	if glob.nocolor:
+		txt = TERM_RE.sub("", txt)
+	if glob.log_fn is not None:
+		glob.log_fn(txt)
+	else:
+		print(txt, end = '', flush = True)
+	return
+#/def _OUT
+
+
 def _DBG(msg) -> None:
 	if glob.debug_mode:
-		print(msg, end = '', flush = True)
+		_OUT(msg)
 	return
 #/def _DBG
 
 
 def _LOG(tit, sub=None) -> None:
 	if sub == None:
-		print(tit, end = '', flush = True)
+		_OUT(tit)
 	else:
-		print(term.title + tit + term.values + sub, end = '', flush = True)
+		_OUT(term.title + tit + term.values + sub)
 	return
 #/def _LOG
 
@@ -152,14 +449,35 @@ def _greySpace(txt: str) -> str:
 #/def _greySpace
 
 
+# Make g the current Globals. Returns the previous one.
+def glob_switch(g: Globals) -> Globals:
+	global glob
+	prev = glob
+	glob = g
+	return prev
+#/def glob_switch
+
+
+# Call fn(*args) with g as the current Globals, for callbacks of batch jobs.
+def glob_call(g: Globals, fn, *args):
+	prev = glob_switch(g)
+	try:
+		return fn(*args)
+	finally:
+		glob_switch(prev)
+#/def glob_call
+
+
 #***** Other functions *********************************************************
-def err_exit(msg: str = None) -> None:
-	if msg is not None:
-		print(msg)
-	sys.exit(-1)
+# Raised by err_exit(), with the error message. The command line prints it and
+# exits, see main().
+class AnimPcbError(Exception):
+	pass
 
-	# Never reached.
-	return
+
+def err_exit(msg: str = None) -> None:
+	msg = msg if msg is not None else ""
+	raise AnimPcbError(TERM_RE.sub("", msg) if glob.nocolor else msg)
 
 
 def check_existance_infile() -> None:
@@ -171,59 +489,477 @@ def check_existance_infile() -> None:
 # /def
 
 
-def wait_available_thread_slots(at_least: int = 1) -> bool:
-	def remove_returned() -> bool:
-		retval = False
-		for i in range(len(glob.proc_list)):
-			po = glob.proc_list[i]
-			poll_ret = po.poll()
+def sched_init() -> None:
+	glob.sched_sel = selectors.DefaultSelector()
 
-			if poll_ret is None:		# Still running.
+	try:
+		os.close(os.pidfd_open(os.getpid()))
+		glob.sched_sigfd = None				# pidfd per child available.
+	except (AttributeError, OSError):
+		# No pidfds. Let SIGCHLD write to a pipe we can select() on instead.
+		rfd, wfd = os.pipe()
+		os.set_blocking(rfd, False)
+		os.set_blocking(wfd, False)
+		signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+		signal.set_wakeup_fd(wfd)
+		glob.sched_sigfd = rfd
+		glob.sched_sel.register(rfd, selectors.EVENT_READ, None)
+	return
+#/def sched_init
+
+
+# Undo sched_init(), killing the children still running after an error.
+def sched_close() -> None:
+	if glob.sched_sel is None:
+		return
+	for po in glob.proc_list:
+		if isinstance(po, subprocess.Popen) and po.poll() is None:
+			proc_kill(po)
+			po.wait()
+		if getattr(po, "pidfd", None) is not None:
+			os.close(po.pidfd)
+			po.pidfd = None
+	glob.proc_list.clear()
+	if glob.sched_sigfd is not None:
+		os.close(signal.set_wakeup_fd(-1))
+		signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+		os.close(glob.sched_sigfd)
+		glob.sched_sigfd = None
+	glob.sched_sel.close()
+	glob.sched_sel = None
+	return
+#/def sched_close
+
+
+# Reap a child if it has exited, without blocking. Returns True if it has.
+def sched_reap(po: subprocess.Popen) -> bool:
+	try:
+		pid, status, rusage = os.wait4(po.pid, os.WNOHANG)
+	except ChildProcessError:				# Already reaped elsewhere.
+		po.poll()
+		pid, status, rusage = po.pid, None, None
+	if pid == 0:
+		return False
+
+	if status is not None:
+		po.returncode = os.waitstatus_to_exitcode(status)
+	po.rusage = rusage
+	po.t_end = time.monotonic()
+
+	if getattr(po, "core_set", None) is not None:
+		glob.core_use[po.core_set] -= 1
+		po.core_set = None
+	if getattr(po, "pidfd", None) is not None:
+		glob.sched_sel.unregister(po.pidfd)
+		os.close(po.pidfd)
+		po.pidfd = None
+	return True
+#/def sched_reap
+
+
+# Handle the events from one select() on glob.sched_sel: run I/O handlers and
+# reap the children that have exited. Returns True if any of them failed.
+def sched_handle_events(events) -> bool:
+	retval = False
+
+	for key, mask in events:			# I/O handlers, e.g. stream_feed().
+		if callable(key.data):
+			key.data(mask)
+
+	if glob.sched_sigfd is None:		# Only look at the children that woke us.
+		candidates = [key.data for key, mask in events
+						if isinstance(key.data, subprocess.Popen)]
+	else:								# SIGCHLD doesn't say which, check all.
+		try:
+			while os.read(glob.sched_sigfd, 512):
 				pass
-			else:
-				glob.proc_list[i] = None# Mark removed in Popen list with placeholder None.
-				if poll_ret == 0:		# Returned without error...
-					pass				# ... do nothing.
-				else:					# Returned with error.
-					retval |= True		# Remember that at least one error has occured.
-					stdout, stderr = po.communicate()	# Get output.
-					_LOG(term.err + stdout + stderr + term.normal + "\n")
-				# /if
-			# /if
-
-
-		while (None in glob.proc_list):	# Remove all None entries from process list.
-			glob.proc_list.remove(None)
-		return retval
-	#/def remove_returned
-
-	ret = remove_returned()
-	while ((glob.max_threads - len(glob.proc_list)) < at_least):
-		ret |= remove_returned()
+		except BlockingIOError:
+			pass
+		candidates = [po for po in glob.proc_list if isinstance(po, subprocess.Popen)]
+
+	for po in candidates:
+		if not sched_reap(po):			# Still running.
+			continue
+
+		glob.proc_list.remove(po)
+		sched_drain(po)					# Whatever is left in the pipe.
+		po.errtext = ""
+		if po.returncode == 0:			# Returned without error...
+			pass						# ... do nothing.
+		else:							# Returned with error.
+			retval |= True				# Remember that at least one error has occured.
+			po.errtext = po.out_buf.decode(errors = "replace")	# Get output.
+			if po.timed_out:
+				po.errtext += f"killed after {po.t_end - po.t_start:.1f}s timeout\n"
+			_LOG(term.err + "\n" + po.errtext + term.normal + "\n")
+		# /if
+		if po.on_exit is not None:
+			glob_call(po.glob, po.on_exit, po)
+	return retval
+#/def sched_handle_events
+
+
+# Read what a process has written to its stdout/stderr pipe without blocking,
+# keeping only the last out_tail bytes so memory use is bounded however much
+# it writes. At EOF the pipe is closed.
+def sched_drain(po: subprocess.Popen, mask: int = 0) -> None:
+	if po.stdout is None or po.stdout.closed:
+		return
+	fd = po.stdout.fileno()
+	try:
+		while True:
+			data = os.read(fd, 65536)
+			if not data:					# EOF
+				glob.sched_sel.unregister(fd)
+				po.stdout.close()
+				break
+			po.out_buf += data
+			if len(po.out_buf) > glob.out_tail:
+				del po.out_buf[:len(po.out_buf) - glob.out_tail]
+	except BlockingIOError:
+		pass
+	return
+#/def sched_drain
+
+
+# Wait for I/O or exiting children, at most timeout s, and kill processes that
+# have run past their deadline. Returns True if any process failed.
+def sched_wait(timeout: float = None) -> bool:
+	deadlines = [po.deadline for po in glob.proc_list
+					if po.deadline is not None and not po.timed_out]
+	if deadlines:
+		t = max(0, min(deadlines) - time.monotonic())
+		timeout = t if timeout is None else min(timeout, t)
+
+	glob.sched_cpu_sec += time.process_time() - glob.sched_t0
+	events = glob.sched_sel.select(timeout)	# Blocks without using any CPU.
+	glob.sched_t0 = time.process_time()
+	ret = sched_handle_events(events)
+
+	now = time.monotonic()
+	for po in glob.proc_list:
+		if po.deadline is not None and now >= po.deadline and not po.timed_out:
+			po.timed_out = True				# Reaped as failed by a later sched_wait().
+			if isinstance(po, subprocess.Popen):
+				proc_kill(po)
+			else:							# ServerTask
+				po.kill()
+	return ret
+#/def sched_wait
+
+
+# Kill a process of run_thread() or server_start() together with the processes
+# it started, e.g. kicad-cli behind a wrapper script: it leads a session of its own.
+def proc_kill(po: subprocess.Popen) -> None:
+	try:
+		os.killpg(po.pid, signal.SIGKILL)
+	except OSError:
+		po.kill()
+	return
+#/def proc_kill
+
+
+def wait_available_thread_slots(at_least: int = 1) -> bool:
+	glob.sched_t0 = time.process_time()
+	ret = sched_handle_events([])
+	while glob.proc_list and ((glob.max_threads - len(glob.proc_list)) < at_least):
+		ret |= sched_wait()
+	glob.sched_cpu_sec += time.process_time() - glob.sched_t0
 
 	return ret
 #/def wait_available_thread_slots
 
 
-def run_thread(cmd: str, args: list) -> None:
+# Resident memory of a process in MB, 0 if it's gone.
+def proc_rss_mb(pid: int) -> float:
+	try:
+		with open(f"/proc/{pid}/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+	except (OSError, ValueError, IndexError):
+		return 0
+#/def proc_rss_mb
+
+
+# May another render be started? Within max_threads, only if the available
+# memory has room for it after the running renders have grown to the peak seen
+# so far (or --mem-per-job before any has finished). One is always admitted.
+def sched_admit() -> bool:
+	if len(glob.proc_list) >= glob.max_threads:
+		return False
+	if not glob.proc_list or glob.mem_per_job_mb <= 0:
+		return True
+	avail = mem_available_mb()
+	if avail is None:
+		return True
+
+	need = glob.tel_rss_kb / 1024 if glob.tel_rss_kb else glob.mem_per_job_mb
+	for po in glob.proc_list:
+		avail -= max(0, need - proc_rss_mb(po.server.pid if isinstance(po, ServerTask) else po.pid))
+	if avail >= need:
+		return True
+	glob.mem_deferred += 1
+	return False
+#/def sched_admit
+
+
+# on_exit, if given, is called with the Popen object once the process has been reaped.
+# With a timeout, the process is killed if it runs longer than that many s.
+def run_thread(cmd, args: list, on_exit = None, timeout: float = None) -> subprocess.Popen:
 	if len(glob.proc_list) > glob.max_threads:
-		err_exit(term.error + "proc_list overflow\n")
+		err_exit(term.err + "proc_list overflow\n")
+
+	cmd_list = (cmd if isinstance(cmd, list) else [cmd]) + args
+	t0 = time.process_time()
+
+	po = subprocess.Popen(cmd_list,			# OSError goes to the caller.
+							stdin = subprocess.DEVNULL,
+							stdout = subprocess.PIPE,
+							stderr = subprocess.STDOUT,
+							start_new_session = True)	# See proc_kill().
+	po.core_set = core_set_pin(po.pid)
+
+	po.job = None
+	po.glob = glob							# Globals of the batch job it's for.
+	po.out_buf = bytearray()
+	os.set_blocking(po.stdout.fileno(), False)
+	glob.sched_sel.register(po.stdout.fileno(), selectors.EVENT_READ,
+		lambda mask, po = po: sched_drain(po, mask))
+
+	po.t_start = time.monotonic()
+	po.deadline = po.t_start + timeout if timeout is not None else None
+	po.timed_out = False
+	po.pidfd = None
+	po.on_exit = on_exit
+	if glob.sched_sigfd is None:
+		po.pidfd = os.pidfd_open(po.pid)
+		glob.sched_sel.register(po.pidfd, selectors.EVENT_READ, po)
+	glob.proc_list.append(po)
+	glob.sched_jobs += 1
+
+	glob.sched_cpu_sec += time.process_time() - t0
+	return po
+#/def run_thread
 
-	cmd_list = [cmd] + args
 
+# Start rendering one frame with the renderer backend: a kicad-cli process per
+# frame, or a request to an idle renderer server. Same arguments and result as
+# run_thread().
+def run_render(arglist: list, on_exit = None, timeout: float = None):
+	if glob.backend == "server":
+		return server_submit(arglist, on_exit, timeout)
+	return run_thread(glob.kicad_cli_cmd, arglist, on_exit, timeout)
+#/def run_render
+
+
+#***** Renderer servers ********************************************************
+
+# Start a renderer server. It stays up for the whole run, rendering one frame at
+# a time, so loading the board and its 3D models is paid once per server.
+def server_start() -> subprocess.Popen:
+	idle = [po for po in glob.servers if po.task is None]
+	if len(glob.servers) >= glob.max_threads and idle:
+		server_stop(idle[0])				# Of another batch job's server command.
+
+	po = subprocess.Popen(glob.server_cmd,
+							stdin = subprocess.PIPE,
+							stdout = subprocess.PIPE,
+							stderr = subprocess.DEVNULL,
+							start_new_session = True)
+	po.cmd = glob.server_cmd
+	po.core_set = core_set_pin(po.pid)
+	po.task = None
+	po.in_buf = bytearray()
+	os.set_blocking(po.stdout.fileno(), False)
+	glob.sched_sel.register(po.stdout.fileno(), selectors.EVENT_READ,
+		lambda mask, po = po: server_read(po))
+	glob.servers.append(po)
+	return po
+#/def server_start
+
+
+def server_submit(arglist: list, on_exit = None, timeout: float = None) -> ServerTask:
+	if len(glob.proc_list) > glob.max_threads:
+		err_exit(term.err + "proc_list overflow\n")
+	t0 = time.process_time()
+
+	server = next((po for po in glob.servers if po.task is None and po.cmd == glob.server_cmd),
+					None) or server_start()
+	task = ServerTask(server, on_exit, glob, time.monotonic())
+	if timeout is not None:
+		task.deadline = task.t_start + timeout
+	server.task = task
+	try:									# An idle server has room in its pipe.
+		server.stdin.write(json.dumps(arglist).encode() + b"\n")
+		server.stdin.flush()
+	except BrokenPipeError:					# Died, server_read() fails the task.
+		pass
+	glob.proc_list.append(task)
+	glob.sched_jobs += 1
+
+	glob.sched_cpu_sec += time.process_time() - t0
+	return task
+#/def server_submit
+
+
+# Read the replies of a server. At EOF it has exited, failing its task if any.
+def server_read(po: subprocess.Popen) -> None:
+	fd = po.stdout.fileno()
 	try:
-		glob.proc_list.append(subprocess.Popen(cmd_list,
-												stdin = subprocess.PIPE,
-												stdout = subprocess.PIPE,
-												stderr = subprocess.PIPE,
-												text = True))
-	except OSError:
-		raise		# Re-raise to function's caller.
+		data = os.read(fd, 65536)
+	except BlockingIOError:
+		return
+	po.in_buf += data
+
+	while b"\n" in po.in_buf:
+		line, _, rest = bytes(po.in_buf).partition(b"\n")
+		po.in_buf = bytearray(rest)
+		try:
+			reply = json.loads(line)
+			ok, error = bool(reply.get("ok")), str(reply.get("error", ""))
+		except (ValueError, AttributeError):
+			ok, error = False, "bad reply from renderer server: " + line.decode(errors = "replace")
+		server_done(po, ok, error)
+
+	if not data:
+		server_stop(po)
+		if po.task is not None:
+			server_done(po, False, "renderer server exited with code " + f"{po.returncode}")
 	return
-#/def run_thread
+#/def server_read
+
+
+def server_done(po: subprocess.Popen, ok: bool, error: str) -> None:
+	task = po.task
+	if task is None:
+		return
+	po.task = None
+	glob.proc_list.remove(task)
+	task.t_end = time.monotonic()
+	task.returncode = 0 if ok else 1
+	if not ok:
+		task.errtext = error + "\n"
+		if task.timed_out:
+			task.errtext += f"killed after {task.t_end - task.t_start:.1f}s timeout\n"
+		_LOG(term.err + "\n" + task.errtext + term.normal + "\n")
+	if task.on_exit is not None:
+		glob_call(task.glob, task.on_exit, task)
+	return
+#/def server_done
+
+
+# Close the server's stdin so it exits, and wait for it.
+def server_stop(po: subprocess.Popen) -> None:
+	if po not in glob.servers:
+		return
+	glob.servers.remove(po)
+	glob.sched_sel.unregister(po.stdout.fileno())
+	try:
+		po.stdin.close()
+	except BrokenPipeError:
+		pass
+	po.stdout.close()
+	po.wait()
+	if po.core_set is not None:
+		glob.core_use[po.core_set] -= 1
+	return
+#/def server_stop
+
+
+def server_stop_all() -> None:
+	for po in list(glob.servers):
+		server_stop(po)
+	return
+#/def server_stop_all
+
+
+# CPUs this process may run on, further limited by a cgroup CPU quota if any.
+def cpus_available() -> int:
+	try:
+		cpus = len(os.sched_getaffinity(0))
+	except AttributeError:
+		cpus = os.cpu_count() or 1
+
+	quota = None
+	try:									# cgroup v2
+		with open("/sys/fs/cgroup/cpu.max") as f:
+			q, period = f.read().split()
+			if q != "max":
+				quota = int(q) / int(period)
+	except (OSError, ValueError):
+		try:								# cgroup v1
+			with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+				q = int(f.read())
+			with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+				period = int(f.read())
+			if q > 0:
+				quota = q / period
+		except (OSError, ValueError):
+			pass
+
+	if quota is not None:
+		cpus = min(cpus, max(1, math.floor(quota)))
+	return cpus
+#/def cpus_available
+
+
+# MemAvailable from /proc/meminfo in MB, or None if unknown.
+def mem_available_mb() -> int:
+	try:
+		with open("/proc/meminfo") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) // 1024
+	except (OSError, ValueError):
+		pass
+	return None
+#/def mem_available_mb
+
+
+# Number of concurrent kicad-cli instances for "-j auto": one per core set
+# of --threads-per-job cores, but no more than fit in available memory.
+def jobs_auto() -> int:
+	jobs = max(1, cpus_available() // glob.threads_per_job)
+	mem = mem_available_mb()
+	if mem is not None and glob.mem_per_job_mb > 0:
+		jobs = max(1, min(jobs, mem // glob.mem_per_job_mb))
+	return jobs
+#/def jobs_auto
+
+
+# Split the CPUs we may run on into sets of --threads-per-job for --pin.
+def core_sets_init() -> None:
+	try:
+		cpus = sorted(os.sched_getaffinity(0))
+	except AttributeError:
+		err_exit(term.err + "***ERROR*** --pin not supported on this platform\n" + term.normal)
+
+	n = glob.threads_per_job
+	glob.core_sets = [set(cpus[i:i + n]) for i in range(0, len(cpus) - n + 1, n)]
+	if not glob.core_sets:
+		glob.core_sets = [set(cpus)]
+	glob.core_use = [0] * len(glob.core_sets)
+	_DBG(term.title + "Core sets " + term.values + str(glob.core_sets) + "\n")
+	return
+#/def core_sets_init
+
+
+# With --pin, pin a process just started to the least used core set and return
+# its index, for core_use to be decremented when it's done. Not done in
+# preexec_fn, which isn't safe with threads.
+def core_set_pin(pid: int) -> int:
+	if not glob.core_sets:
+		return None
+	core_set = glob.core_use.index(min(glob.core_use))
+	glob.core_use[core_set] += 1
+	try:
+		os.sched_setaffinity(pid, glob.core_sets[core_set])
+	except OSError:							# Exited already.
+		pass
+	return core_set
+#/def core_set_pin
 
 
-def parse_cmdline() -> None:
+def parse_cmdline(argv: list = None) -> None:
 	def XY_size(XxY):
 		if len(XxY) >= 3:
 			if XxY.count("x") == 1:
@@ -234,6 +970,36 @@ def parse_cmdline() -> None:
 		raise argparse.ArgumentTypeError(f"must be e.g. 640x480")
 	# /def
 
+	def jobs_type(s):
+		if s == "auto" or (s.isdigit() and int(s) >= 1):
+			return s
+		raise argparse.ArgumentTypeError(f"must be a positive integer or 'auto'")
+	# /def
+
+	def chunks_type(s):
+		if s == "segments" or (s.isdigit() and int(s) >= 1):
+			return s
+		raise argparse.ArgumentTypeError(f"must be a positive integer or 'segments'")
+	# /def
+
+	def order_type(s):
+		name, _, n = s.partition(":")
+		if s in ("sequential", "segment", "cost", "interleave") or (
+				name == "interleave" and n.isdigit() and int(n) >= 2):
+			return s
+		raise argparse.ArgumentTypeError(f"must be sequential, interleave[:N], segment or cost")
+	# /def
+
+	def jobs_list(s):
+		try:
+			lst = [int(j) for j in s.split(",")]
+		except ValueError:
+			lst = []
+		if lst and min(lst) >= 1:
+			return lst
+		raise argparse.ArgumentTypeError(f"must be e.g. 2,4,8")
+	# /def
+
 	parser = argparse.ArgumentParser(
 		description='Parallellized PCB animation video creation by calling multiple kicad-cli-nightly instances repeatedly to render the individual frames, then optionally joining the created image files to a video with ffmpeg.',
 		allow_abbrev=False,	formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -253,10 +1019,15 @@ Whitespace separating parts can be any length.
 
 Semiformal syntax description of segm_expr:
 
-segm_expr	::= dur_expr WS from_expr WS "->" WS toward_expr
-from_expr	::= toward_expr
+segm_expr	::= dur_expr WS from_expr WS "->" WS (key_expr WS "->" WS)* toward_expr
+from_expr	::= [ease_expr] [rotpath_expr] toward_expr
+key_expr	::= toward_expr
 toward_expr	::= [zoom_expr] [rot_expr] [pan_expr] [piv_expr]
 dur_expr	::= floatnumber ("s" | "ms")
+ease_expr	::= "ease" "(" [WS] (ease_name | x1 "," y1 "," x2 "," y2) [WS] ")"
+ease_name	::= "linear" | "in" | "out" | "inout" | "cubic"
+rotpath_expr	::= "rotpath" "(" [WS] ("long" | "short") [WS] ")"
+x1..y2		::= floatnumber
 zoom_expr	::= "z" "(" [WS] floatnumber [WS] ")"
 rot_expr	::= "rot" "(" [WS] rotax [WS] "," [WS] rotay [WS] "," [WS] rotaz [WS] ")"
 pan_expr	::= "pan" "(" [WS] panax [WS] "," [WS] panay [WS] "," [WS] panaz [WS] ")"
@@ -266,7 +1037,13 @@ panax..z	::= floatnumber
 pivx..z		::= floatnumber
 WS			::= (SP | TAB | NEWLINE)*
 
-Animation is made by interpolating the positional parameters between (from_expr) and (toward_expr) in the intermediate frames.
+Animation is made by interpolating the positional parameters between (from_expr) and (toward_expr) in the intermediate frames. The first frame of a segment is exactly (from_expr). If the next segment starts at this segment's (toward_expr), that pose is left to the next segment, otherwise the last frame is exactly (toward_expr).
+
+With one or more (key_expr), the segment passes through each of them in turn, on a smooth Catmull-Rom spline through all the poses, spending equal time between each pair. All of them must have the same terms as (from_expr).
+
+(ease) shapes the motion over time: "in" starts slowly, "out" ends slowly, "inout" and "cubic" do both, "linear" is the default. x1,y1,x2,y2 give a custom cubic bezier curve from (0,0) to (1,1), like CSS timing functions, with x1 and x2 in [0..1].
+
+(rotpath) "short" makes each rotation step take the shortest way round, e.g. 350 -> 10 turns 20 degrees instead of -340. The default "long" interpolates the angles as given.
 
 It's questionable if pivot animation is useful, but it can be, in the interest of flexibility.
 
@@ -274,7 +1051,7 @@ It's questionable if pivot animation is useful, but it can be, in the interest o
 
 (zoom) is the camera zoomin. If absent, 1.0 is used.
 
-(rotax, rotay, rotaz) define the PCBs rotation around the x,y,z-axii. If absent, (0,0,0) are used. kicad-cli-nightly seems to dislike angles outside the [-360..360] range, so don't use values outside this. TODO remainder division/normalize/direction arithmetic.
+(rotax, rotay, rotaz) define the PCBs rotation around the x,y,z-axii. If absent, (0,0,0) are used. kicad-cli-nightly seems to dislike angles outside the [-360..360] range, so interpolated angles outside it are brought back inside by remainder division.
 
 (panax, panay, panaz) define, if included, the viewpoint's panning.
 
@@ -293,6 +1070,19 @@ With two segments, first a 2s slow rotation, then a faster 1s one backwards to t
 Zoom in from afar while rotating:
 --segment "3s z(0.1) rot(90,90,0) -> z(0.9) rot(0,0,0)"
 
+Smooth start and stop, through two intermediate poses, the short way round:
+--segment "4s ease(inout) rotpath(short) rot(0,0,0) -> rot(90,30,0) -> rot(180,0,30) -> rot(350,0,0)"
+
+############### --batch job file ###############
+
+A JSON, TOML (Python >= 3.11) or YAML (with PyYAML installed) file with an optional table of "defaults" and a list of "jobs". Each job is a table of long options without the leading "--", with a list for options given more than once and true for flags. The options of the command line come first, then the defaults, then those of the job, so e.g. a --segment on the command line is used by every job.
+
+{"defaults": {"res": "640x480", "segment": ["2s rot(0,0,0) -> rot(0,0,360)"]},
+ "jobs": [{"in": "rev_a.kicad_pcb", "out": "rev_a.mp4"},
+          {"in": "rev_b.kicad_pcb", "out": "rev_b.mp4", "priority": 2}]}
+
+All frames of all jobs are rendered by the same -j job slots, shared between the jobs in proportion to their --priority, and each video is encoded as soon as its frames are done while the frames of the others are rendered.
+
 
 '''									)
 
@@ -304,7 +1094,16 @@ Zoom in from afar while rotating:
 						help='overwrite existing images')
 	parser.add_argument('--cli', type=str, metavar='</path/to/kicad-cli>',
 						default='kicad-cli-nightly',
-						help='kicad-cli executable (default: %(default)s)')
+						help='kicad-cli executable. "stand-in" uses a built-in fake renderer writing plain PNGs, for testing (default: %(default)s)')
+
+	parser.add_argument('--backend', type=str, metavar='exec|server', dest='backend',
+						default='exec', choices=['exec', 'server'],
+						help='"exec" starts a kicad-cli per frame, "server" sends the frames to up to -j long-lived --server-cmd processes, each loading the board once (default: %(default)s)')
+	parser.add_argument('--server-cmd', type=str, metavar='<command line>', dest='server_cmd',
+						default=None,
+						help='renderer server for --backend server. It reads a JSON list of kicad-cli render args per line on stdin and answers each with a line {"ok": true} or {"ok": false, "error": "..."} on stdout (default with --cli stand-in: the built-in stand-in renderer)')
+	parser.add_argument('--bench-backends', action='store_true', dest='bench_backends',
+						help='render --bench-frames frames with each backend, report the time per frame and the startup cost saved by the server, and exit')
 
 	parser.add_argument('--dry-run', action='store_true', dest='dry_run',
 						help='go through all motions except modifying any files')
@@ -318,17 +1117,132 @@ Zoom in from afar while rotating:
 	parser.add_argument('--img_format', type=str, metavar='jpg|png',
 						default='png', choices=['jpg', 'png'],
 						help='image format of frames (default: %(default)s)')
-	parser.add_argument('-j', '--jobs', type=int, choices=range(1,9), metavar='<integer>',
-						default=8,
-						help='maximum number of concurrent jobs, [1..8] (default: %(default)d)')
+	parser.add_argument('-j', '--jobs', type=jobs_type, metavar='<integer>|auto',
+						default='auto',
+						help='maximum number of concurrent jobs. "auto" uses one per --threads-per-job available CPUs, limited by cgroup CPU quota and --mem-per-job (default: %(default)s)')
+	parser.add_argument('--threads-per-job', type=int, metavar='<integer>', dest='threads_per_job',
+						default=1,
+						help='CPUs per kicad-cli instance, used by "-j auto" and --pin (default: %(default)d)')
+	parser.add_argument('--pin', action='store_true', dest='pin',
+						help='pin each kicad-cli instance to its own set of --threads-per-job CPUs')
+	parser.add_argument('--mem-per-job', type=int, metavar='<MB>', dest='mem_per_job',
+						default=1024,
+						help='expected memory use of one kicad-cli instance, used by "-j auto". Until the peak memory use of a finished render is known, it is also what a new job must find available besides the running ones to be started. 0 to ignore (default: %(default)d)')
+	parser.add_argument('--interp', type=int, metavar='<N>', dest='interp',
+						default=1,
+						help='render only every Nth frame and synthesize the frames between them with ffmpeg minterpolate. Synthesized frames have no transparency (default: %(default)d, render all)')
+	parser.add_argument('--interp-mode', type=str, metavar='mci|blend', dest='interp_mode',
+						default='mci', choices=['mci', 'blend'],
+						help='minterpolate mode: motion compensated, or cross-fading (default: %(default)s)')
+	parser.add_argument('--interp-max-motion', type=float, metavar='<degrees>', dest='interp_max',
+						default=5,
+						help='render the frames between two rendered frames after all if the rotation between them is larger than this. 1%% zoom counts as 1 degree, any pan or pivot change as too large (default: %(default)s)')
+	parser.add_argument('--tiles', type=int, metavar='<N>', dest='tiles',
+						default=1,
+						help='render each frame as NxN tiles, zoomed in N times and panned, as separate jobs, and stitch them with ffmpeg. Needs --tile-span and --no-kc-perspective (default: %(default)d)')
+	parser.add_argument('--tile-span', type=str, metavar='<x,y>', dest='tile_span',
+						default=None,
+						help='the --pan change that moves the view right by one frame width and up by one frame height at zoom 1, measured for the board')
+	parser.add_argument('--bench-jobs', type=jobs_list, metavar='<j1,j2,...>', dest='bench_jobs',
+						default=None,
+						help='render --bench-frames frames with each of the given -j values, report frames/s and exit')
+	parser.add_argument('--bench-frames', type=int, metavar='<integer>', dest='bench_frames',
+						default=None,
+						help='number of frames per --bench-jobs run (default: 2 * largest -j value)')
 
 	parser.add_argument('--out', type=str, metavar='<file>', dest='outfile', default=None,
 						help='output video file, e.g. "video.mp4". If absent, the frames will be rendered but no video created')
 
+	parser.add_argument('--resume', action='store_true', dest='resume',
+						help='continue an interrupted run: skip frames recorded as done in the journal in --tmpdir, validate other existing images and render the rest')
+	parser.add_argument('--order', type=order_type, metavar='sequential|interleave[:N]|segment|cost', dest='order',
+						default='sequential',
+						help='order frames are rendered in, their numbers stay the same. "interleave" first renders every Nth frame, then those halfway between them and so on, so the whole video is covered early. "segment" takes turns between the --segments. "cost" renders the frames predicted to take longest first, after sampling frames spread over the video, so no long frame is left for the end (default: %(default)s, interleave: N=16)')
+	parser.add_argument('--longest-first', action='store_true', dest='longest_first',
+						help='same as --order cost')
+	parser.add_argument('--stream', action='store_true', dest='stream',
+						help='start ffmpeg right away and feed it frames while rendering, requires --out')
+	parser.add_argument('--stream-delete', action='store_true', dest='stream_delete',
+						help='with --stream, delete numbered frame files once they have been fed to ffmpeg')
+	parser.add_argument('--disk-budget', type=int, metavar='<MB>', dest='disk_budget',
+						default=None,
+						help='with --stream, implies --stream-delete and holds back new renders while the frames waiting to be fed to ffmpeg take more than this. With the frame cache, a frame\'s cache entry is deleted too once its last copy has been fed')
+
+	parser.add_argument('--dump-frames', type=str, metavar='<file.csv>', dest='dump_frames',
+						default=None,
+						help='write the pose of every frame to a CSV file and exit')
+
+	parser.add_argument('--save-plan', type=str, metavar='<file>', dest='save_plan',
+						default=None,
+						help='write the frame plan (the pose of every frame, and which frames are identical) to a compact binary file and exit')
+	parser.add_argument('--plan', type=str, metavar='<file>', dest='plan',
+						default=None,
+						help='render the frames of a --save-plan file instead of --segment, at its frame rate. --res and the --kc-* options still apply')
+
+	parser.add_argument('--preview', type=int, metavar='<N>', dest='preview',
+						default=0,
+						help='render previews first: every Nth frame, then all frames, at 1/--preview-scale resolution and basic quality, encoded to <out>.preview1.* and <out>.preview.*, then the final video')
+	parser.add_argument('--preview-scale', type=int, metavar='<integer>', dest='preview_scale',
+						default=4,
+						help='resolution divisor of preview frames (default: %(default)d)')
+	parser.add_argument('--preview-only', action='store_true', dest='preview_only',
+						help='stop after the --preview passes')
+
+	parser.add_argument('--coordinator', type=str, metavar='<host:port>', dest='coordinator',
+						default=None,
+						help='do not render locally, hand out frames to --worker processes connecting to <host:port>')
+	parser.add_argument('--worker', type=str, metavar='<host:port>', dest='worker',
+						default=None,
+						help='render frames for the --coordinator at <host:port> with up to -j local jobs, until it is done. --in, --res and --segment are not used')
+	parser.add_argument('--worker-timeout', type=float, metavar='<s>', dest='worker_timeout',
+						default=30,
+						help='seconds without heartbeat after which a worker is considered dead and its frames are reassigned (default: %(default)s)')
+	parser.add_argument('--retries', type=int, metavar='<integer>', dest='retries',
+						default=2,
+						help='times a failed frame is retried (default: %(default)d)')
+	parser.add_argument('--retry-backoff', type=float, metavar='<s>', dest='retry_backoff',
+						default=5,
+						help='seconds before the first retry of a frame, doubled for each next (default: %(default)s)')
+	parser.add_argument('--frame-timeout', type=float, metavar='<s>', dest='frame_timeout',
+						default=None,
+						help='kill a kicad-cli that renders one frame for longer than this, and retry it (default: no limit)')
+	parser.add_argument('--fill-failed', action='store_true', dest='fill_failed',
+						help='replace frames that failed all retries with the nearest good frame and make the video anyway')
+	parser.add_argument('--retry-quarantined', action='store_true', dest='retry_quarantined',
+						help='try poses again that failed all retries in more than one earlier run (kept in <tmpdir>/anim_pcb_quarantine.json)')
+
+	parser.add_argument('--telemetry', type=str, metavar='<file.jsonl|file.csv>', dest='telemetry',
+						default=None,
+						help='write a record per rendered frame (queue wait, wall and CPU time, peak RSS, size, exit code, pose) and print a summary at the end')
+
+	parser.add_argument('--progress', type=str, metavar='auto|tty|log|json|frames|quiet', dest='progress',
+						default='auto', choices=['auto', 'tty', 'log', 'json', 'frames', 'quiet'],
+						help='how rendering progress is shown: "tty" as one line rewritten in place, "log" as a line every --progress-interval, "json" as a JSON object per line, "frames" as a line per frame, "quiet" not at all. "auto" is tty on a terminal, else log (default: %(default)s)')
+	parser.add_argument('--progress-interval', type=float, metavar='<s>', dest='progress_interval',
+						default=None,
+						help='seconds between progress reports (default: 0.5 for tty, 10 for log and json)')
+
+	parser.add_argument('--log-tail', type=int, metavar='<KB>', dest='log_tail',
+						default=16,
+						help='output of kicad-cli and ffmpeg is read continuously and the last <KB> kept for error messages (default: %(default)d)')
+
 	parser.add_argument('--tmpdir', type=str, metavar='<directory>',
 						default='.',
 						help='tmp file directory (default: %(default)s)')
 
+	parser.add_argument('--stage', type=str, metavar='<directory>', dest='stage',
+						nargs='?', const='auto', default=None,
+						help='copy the board and its 3D models to <directory> (default: /dev/shm if available, else --tmpdir) and render from there, removed when done')
+
+	parser.add_argument('--cache-dir', type=str, metavar='<directory>', dest='cache_dir',
+						default=None,
+						help='rendered frame cache directory (default: <tmpdir>/anim_pcb_cache)')
+	parser.add_argument('--cache-size', type=int, metavar='<MB>', dest='cache_size',
+						default=4096,
+						help='frame cache size limit, least recently used frames are evicted (default: %(default)d)')
+	parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+						help='do not use the frame cache, keep/overwrite numbered frames directly')
+
 	kc = parser.add_argument_group('options used when calling kicad-cli[-nightly]')
 	kc.add_argument('--kc-background', dest='kc_background',
 					type=str, metavar='transparent|opaque', default='transparent',
@@ -346,20 +1260,100 @@ Zoom in from afar while rotating:
 	kc.add_argument('--no-kc-perspective', dest='kc_perspective', action='store_true',
 					help='do NOT use --perspective (default: %(default)s)')
 
-	req = parser.add_argument_group('required arguments')
+	enc = parser.add_argument_group('options used when calling ffmpeg')
+	enc.add_argument('--encoder', dest='encoder',
+					type=str, metavar='|'.join(ENC_PROFILES), default='x264',
+					choices=list(ENC_PROFILES),
+					help='video codec profile. vp9 (.webm) and prores (.mov) can keep the transparent background with --alpha (default: %(default)s)')
+	enc.add_argument('--preset', type=str, metavar='<preset>', dest='preset',
+					default=None,
+					help='encoder speed preset, -cpu-used for vp9 (default: slow for x264, medium for x265, 2 for vp9, 8 for av1)')
+	enc.add_argument('--crf', type=int, metavar='<integer>', dest='crf',
+					default=None,
+					help='constant quality, lower is better and larger (default: 22 for x264, 26 for x265, 32 for vp9, 35 for av1)')
+	enc.add_argument('--bitrate', type=str, metavar='<rate>', dest='bitrate',
+					default=None,
+					help='average bitrate instead of --crf, e.g. 2M')
+	enc.add_argument('--target-size', type=float, metavar='<MB>', dest='target_size',
+					default=None,
+					help='encode in two passes at the bitrate that makes a video of this size (1 MB = 10^6 bytes), not with av1, not with --stream')
+	enc.add_argument('--gop', type=int, metavar='<frames>', dest='gop',
+					default=None,
+					help='maximum keyframe interval (default: the encoder\'s)')
+	enc.add_argument('--pix-fmt', type=str, metavar='<format>', dest='pix_fmt',
+					default=None,
+					help='ffmpeg pixel format (default: yuv420p, yuv422p10le for prores, with --alpha yuva420p for vp9, yuva444p10le for prores)')
+	enc.add_argument('--alpha', action='store_true', dest='alpha',
+					help='keep the transparent background in the video, needs --encoder vp9 or prores, --kc-background transparent and --img_format png')
+	enc.add_argument('--encode-chunks', type=chunks_type, metavar='<N>|segments', dest='encode_chunks',
+					default='1',
+					help='encode the video as N frame ranges, or one per --segment, with an ffmpeg per free job slot at once, then join them. Not with --stream (default: %(default)s)')
+
+	parser.add_argument('--batch', type=str, metavar='<jobs.json|jobs.toml|jobs.yaml>', dest='batch',
+						default=None,
+						help='render all jobs of a job file from one queue of frames, see below. --in, --res and --segment are then taken from the jobs')
+	parser.add_argument('--priority', type=float, metavar='<number>', dest='priority',
+						default=1,
+						help='with --batch, a job gets job slots in proportion to its priority (default: %(default)s)')
+
+	req = parser.add_argument_group('required arguments (except with --worker or --batch)')
 
 	req.add_argument('--in',
-					nargs=1, metavar='<file>', dest='pcbfile', required=True,
+					nargs=1, metavar='<file>', dest='pcbfile',
 					help='.kicad_pcb file')
 	req.add_argument('--res',
-					type=XY_size, metavar='<XxY>', nargs=1, required=True,
+					type=XY_size, metavar='<XxY>', nargs=1,
 					help='target video resolution, e.g. 640x480')
 	req.add_argument('-s', '--segment',
 					type=str, metavar='<segm_expr>',
-					action='append', dest='segments', required=True,
+					action='append', dest='segments',
 					help='add video segment. More than one --segment can be specified. See below for syntax.')
 
-	args = parser.parse_args()
+	args = parser.parse_args(argv)
+	glob.argv = list(argv if argv is not None else sys.argv[1:])
+
+	if args.worker is None and args.batch is None:
+		missing = [name for name, val in (("--in", args.pcbfile), ("--res", args.res),
+					("-s/--segment", args.segments if args.plan is None else [])) if val is None]
+		if missing:
+			parser.error("the following arguments are required: " + ", ".join(missing))
+	else:
+		args.pcbfile, args.res, args.segments = [""], ["0x0"], []
+
+	if args.server_cmd is None and args.cli == "stand-in":
+		args.server_cmd = shlex.join([sys.executable, os.path.abspath(__file__), "--stand-in", "--serve"])
+	tile_span = None
+	if args.tiles > 1:
+		try:
+			tile_span = tuple(float(v) for v in args.tile_span.split(","))
+		except (AttributeError, ValueError):
+			tile_span = ()
+		if len(tile_span) != 2:
+			parser.error("--tiles needs --tile-span <x,y>")
+		if args.coordinator is not None:
+			parser.error("--tiles can't be used with --coordinator")
+		if not args.kc_perspective:			# args.kc_perspective is --no-kc-perspective.
+			parser.error("--tiles needs --no-kc-perspective, perspective tiles don't line up")
+		if args.res[0] != "0x0" and (glob.vid_dx % args.tiles or glob.vid_dy % args.tiles):
+			parser.error("--res must be divisible by --tiles")
+	if args.interp > 1 and args.coordinator is not None:
+		parser.error("--interp can't be used with --coordinator")
+	(_, _, crf, _, alpha_fmt, twopass) = ENC_PROFILES[args.encoder]
+	if sum(v is not None for v in (args.crf, args.bitrate, args.target_size)) > 1:
+		parser.error("only one of --crf, --bitrate and --target-size can be used")
+	if crf is None and (args.crf, args.bitrate, args.target_size) != (None, None, None):
+		parser.error(f"--encoder {args.encoder} has no --crf, --bitrate or --target-size")
+	if args.target_size is not None and (twopass is None or args.stream):
+		parser.error("--target-size can't be used with --stream or av1")
+	if args.encode_chunks != "1" and args.stream:
+		parser.error("--encode-chunks can't be used with --stream")
+	if args.alpha and (alpha_fmt is None or args.kc_background != "transparent" or
+						args.img_format != "png"):
+		parser.error("--alpha needs --encoder vp9 or prores, --kc-background transparent and --img_format png")
+	if args.disk_budget is not None and not args.stream:
+		parser.error("--disk-budget needs --stream, otherwise ffmpeg needs all frames at the end")
+	if args.backend == "server" and args.server_cmd is None:
+		parser.error("--backend server needs --server-cmd, kicad-cli can't render more than one frame per call")
 
 
 	glob.debug_mode		=	args.debug
@@ -372,11 +1366,52 @@ Zoom in from afar while rotating:
 	glob.kc_preset		=	args.kc_preset
 	glob.kc_quality		=	args.kc_quality
 	glob.kicad_cli_exe	=	args.cli
-	glob.max_threads	=	args.jobs
+	glob.kicad_cli_cmd	=	([sys.executable, os.path.abspath(__file__), "--stand-in"]
+							if args.cli == "stand-in" else [args.cli])
+	glob.backend		=	args.backend
+	glob.server_cmd		=	shlex.split(args.server_cmd) if args.server_cmd is not None else None
+	glob.bench_backends	=	args.bench_backends
+	glob.dump_frames	=	args.dump_frames
+	glob.save_plan		=	args.save_plan
+	glob.plan_file		=	args.plan
+	glob.preview_every	=	max(0, args.preview)
+	glob.preview_scale	=	max(1, args.preview_scale)
+	glob.preview_only	=	args.preview_only and glob.preview_every > 0
+	glob.coord_addr		=	args.coordinator
+	glob.worker_addr	=	args.worker
+	glob.worker_timeout	=	args.worker_timeout
+	glob.retries		=	args.retries
+	glob.batch_file		=	args.batch
+	glob.priority		=	max(args.priority, 1e-3)
+	glob.progress		=	args.progress
+	if glob.progress == "auto":
+		glob.progress	=	"tty" if glob.log_fn is None and sys.stdout.isatty() else "log"
+	glob.progress_every	=	(args.progress_interval if args.progress_interval is not None
+							else 0.5 if glob.progress == "tty" else 10)
+	glob.enc_profile	=	args.encoder
+	glob.enc_preset		=	args.preset
+	glob.enc_crf		=	args.crf
+	glob.enc_bitrate	=	args.bitrate
+	glob.enc_target_mb	=	args.target_size
+	glob.enc_gop		=	args.gop
+	glob.enc_pix_fmt	=	args.pix_fmt
+	glob.enc_alpha		=	args.alpha
+	glob.enc_chunks		=	args.encode_chunks
+	glob.retry_backoff	=	args.retry_backoff
+	glob.frame_timeout	=	args.frame_timeout
+	glob.fill_failed	=	args.fill_failed
+	glob.retry_quarantined	=	args.retry_quarantined
+	glob.threads_per_job=	max(1, args.threads_per_job)
+	glob.mem_per_job_mb	=	args.mem_per_job
+	glob.pin_cores		=	args.pin
+	glob.bench_jobs		=	args.bench_jobs
+	glob.bench_frames	=	args.bench_frames
+	glob.max_threads	=	jobs_auto() if args.jobs == "auto" else int(args.jobs)
 	glob.nocolor		=	args.nocolor
 	glob.out_file		=	args.outfile
 	glob.overwrite		=	args.overwrite
 	glob.pcb_file		=	args.pcbfile[0]
+	glob.pcb_render		=	glob.pcb_file
 	glob.tmp_dir		=	args.tmpdir
 	glob.vid_fps		=	args.fps
 	glob.vid_res		=	args.res
@@ -384,14 +1419,30 @@ Zoom in from afar while rotating:
 	glob.img_base_name	=	os.path.join(glob.tmp_dir, os.path.basename(glob.pcb_file)
 										+ ".FRAME_")
 	glob.img_suffix		=	"." + glob.img_format
-	glob.segment_args.extend(args.segments)
+	glob.cache_max_mb	=	args.cache_size
+	if args.stage == "auto":
+		glob.stage_dir	=	"/dev/shm" if os.access("/dev/shm", os.W_OK) else args.tmpdir
+	else:
+		glob.stage_dir	=	args.stage
+	glob.tiles			=	max(1, args.tiles)
+	glob.interp			=	max(1, args.interp)
+	glob.interp_mode	=	args.interp_mode
+	glob.interp_max		=	args.interp_max
+	glob.tile_span		=	tile_span
+	glob.stream			=	args.stream and args.outfile is not None
+	glob.stream_delete	=	args.stream_delete or args.disk_budget is not None
+	glob.disk_budget_mb	=	args.disk_budget
+	glob.resume			=	args.resume
+	glob.order, _, step	=	("cost" if args.longest_first else args.order).partition(":")
+	glob.order_step		=	int(step) if step else 16
+	glob.telemetry		=	args.telemetry
+	glob.out_tail		=	max(1, args.log_tail) * 1024
+	if not args.no_cache:
+		glob.cache_dir	=	(args.cache_dir if args.cache_dir is not None
+							else os.path.join(glob.tmp_dir, "anim_pcb_cache"))
+	glob.segment_args.extend(args.segments or [])
 	glob.vid_fpms		=	glob.vid_fps / 1000
 
-	if glob.nocolor:
-		for field in dir(term):
-			if not callable(getattr(term, field)) and not field.startswith("__"):
-				setattr(term, field, "")
-
 	return		# reached iff no illegal arguments
 # /def parseArguments
 
@@ -416,6 +1467,47 @@ def segments_from_args() -> None:
 		return # Never reached
 	#/def SYN_ERR
 
+	# Parse one from/toward/keyframe expression. Returns the set of included
+	# terms and {pose column: value}. Modifiers are only allowed in from_expr.
+	def pose_expr(expr, seg, seg_s, modifiers) -> (set, dict):
+		incl, vals = set(), {}
+		for s in expr.split(")"):
+			snws = ''.join(s.split())
+			if len(snws) > 0:
+				if snws.startswith("z("):
+					incl.add("zoom")
+					try:
+						vals["zoom"] = float(snws[2:])
+					except Exception as e:
+						SYN_ERR(str(e))
+				elif snws.startswith("rot("):
+					incl.add("rot")
+					(vals["rotax"], vals["rotay"], vals["rotaz"]) = triplex(snws[4:], snws)
+				elif snws.startswith("pan("):
+					incl.add("pan")
+					(vals["panax"], vals["panay"], vals["panaz"]) = triplex(snws[4:], snws)
+				elif snws.startswith("piv("):
+					incl.add("piv")
+					(vals["pivx"], vals["pivy"], vals["pivz"]) = triplex(snws[4:], snws)
+				elif modifiers and snws.startswith("ease("):
+					if snws[5:] in EASE_CURVES:
+						seg.ease = EASE_CURVES[snws[5:]]
+					else:
+						try:
+							seg.ease = tuple(float(v) for v in snws[5:].split(","))
+						except Exception as e:
+							SYN_ERR(str(e))
+						if len(seg.ease) != 4 or not (0 <= seg.ease[0] <= 1 and 0 <= seg.ease[2] <= 1):
+							SYN_ERR(snws + ") needs x1,y1,x2,y2 with x1, x2 in [0..1]")
+				elif modifiers and snws.startswith("rotpath("):
+					if snws[8:] not in ("short", "long"):
+						SYN_ERR(snws)
+					seg.rot_short = snws[8:] == "short"
+				else:
+					SYN_ERR(seg_s)
+		return (incl, vals)
+	#/def pose_expr
+
 
 	for i in range(len(glob.segment_args)):
 		_LOG(term.title +"Segment " + term.values + str(i) + term.title + ": \n")
@@ -446,65 +1538,29 @@ def segments_from_args() -> None:
 		except Exception as e:
 			SYN_ERR(str(e))
 
-		if rest_s.count("->") != 1:
+		parts = rest_s.split("->")
+		if len(parts) < 2:
 			SYN_ERR(rest_s)
-		else:
-			(tmp_l_str , tmp_slask, tmp_r_str) = rest_s.partition("->")
-
-		tmp_l_lst,	tmp_r_lst	=	tmp_l_str.split(")"),	tmp_r_str.split(")")
 
-		l_incl_zoom = l_incl_rot = l_incl_pan = l_incl_piv = False
+		(l_incl, fr_vals) = pose_expr(parts[0], seg, glob.segment_args[i], True)
+		(r_incl, to_vals) = pose_expr(parts[-1], seg, glob.segment_args[i], False)
+		keys = [pose_expr(p, seg, glob.segment_args[i], False) for p in parts[1:-1]]
 
-
-		for s in tmp_l_lst:
-			snws = ''.join(s.split())
-			if len(snws) > 0:
-				if snws.startswith("z("):
-					l_incl_zoom = True
-					try:
-						seg.fr_zoom = float(snws[2:])
-					except Exception as e:
-						SYN_ERR(str(e))
-				elif snws.startswith("rot("):
-					l_incl_rot = True
-					(seg.fr_rotax,seg.fr_rotay,seg.fr_rotaz) = triplex(snws[4:], snws)
-				elif snws.startswith("pan("):
-					l_incl_pan = True
-					(seg.fr_panax,seg.fr_panay,seg.fr_panaz) = triplex(snws[4:], snws)
-				elif snws.startswith("piv("):
-					l_incl_piv = True
-					(seg.fr_pivx,seg.fr_pivy,seg.fr_pivz) = triplex(snws[4:], snws)
-				else:
-					SYN_ERR(glob.segment_args[i])
-		for s in tmp_r_lst:
-			snws = ''.join(s.split())
-			if len(snws) > 0:
-				if snws.startswith("z("):
-					seg.incl_zoom = True
-					try:
-						seg.to_zoom = float(snws[2:])
-					except Exception as e:
-						SYN_ERR(str(e))
-				elif snws.startswith("rot("):
-					seg.incl_rot = True
-					(seg.to_rotax,seg.to_rotay,seg.to_rotaz) = triplex(snws[4:], snws)
-				elif snws.startswith("pan("):
-					seg.incl_pan = True
-					(seg.to_panax,seg.to_panay,seg.to_panaz) = triplex(snws[4:], snws)
-				elif snws.startswith("piv("):
-					seg.incl_piv = True
-					(seg.to_pivx,seg.to_pivy,seg.to_pivz) = triplex(snws[4:], snws)
-				else:
-					SYN_ERR(glob.segment_args[i])
-
-
-		if ((seg.incl_zoom != l_incl_zoom) or (seg.incl_rot != l_incl_rot)
-			or (seg.incl_pan != l_incl_pan) or (seg.incl_piv != l_incl_piv)):
+		if l_incl != r_incl or any(k_incl != r_incl for (k_incl, k_vals) in keys):
 			err_exit(term.err + "***ERROR*** Syntax: Terms from/toward mismatch\n" + term.normal)
 
+		seg.incl_zoom, seg.incl_rot = "zoom" in r_incl, "rot" in r_incl
+		seg.incl_pan, seg.incl_piv = "pan" in r_incl, "piv" in r_incl
+		for c in fr_vals:
+			setattr(seg, "fr_" + c, fr_vals[c])
+		for c in to_vals:
+			setattr(seg, "to_" + c, to_vals[c])
+		for (k_incl, k_vals) in keys:
+			seg.keys.append(tuple(k_vals.get(c, 1.0 if c == "zoom" else 0) for c in POSE_COLS))
+
 		seg.frames = math.ceil(seg.dur * float(glob.vid_fps))
 
-		# Interpolation step values
+		# Approximate interpolation step, only displayed. See frame_table().
 		seg.d_zoom	= (seg.to_zoom - seg.fr_zoom) / seg.frames
 		seg.d_rotax	= (seg.to_rotax - seg.fr_rotax) / seg.frames
 		seg.d_rotay	= (seg.to_rotay - seg.fr_rotay) / seg.frames
@@ -525,6 +1581,14 @@ def segments_from_args() -> None:
 		_LOG(f"{seg.dur:.3f}" + term.title + "s (" + term.values)
 		_LOG(f"{seg.frames}" + term.title + " frames)\n")
 
+		if seg.ease is not None:
+			_LOG(term.title + "    easing   " + term.values + str(seg.ease) + "\n")
+		if seg.keys:
+			_LOG(term.title + "    spline   " + term.values + f"{len(seg.keys)}" + term.title +
+				" keyframes between from and toward\n")
+		if seg.rot_short:
+			_LOG(term.title + "    rotation the short way\n")
+
 		if seg.incl_zoom:
 			_LOG(term.title + "    zooming  " + term.values)
 			_LOG(f"{seg.fr_zoom:.2f}" + term.title + " to " + term.values)
@@ -575,131 +1639,2131 @@ def segments_from_args() -> None:
 #/def segments_from_args
 
 
-def render_frames() -> None:
-	cli_static_args	= ["pcb", "render"]
-
-	frame_index = 0
-	for seg_index in range(len(glob.segments)):
-		seg = glob.segments[seg_index]
-		zoom = seg.fr_zoom
-		rotax, rotay, rotaz = seg.fr_rotax, seg.fr_rotay, seg.fr_rotaz
-		panax, panay, panaz = seg.fr_panax, seg.fr_panay, seg.fr_panaz
-		pivx, pivy, pivz = seg.fr_pivx, seg.fr_pivy, seg.fr_pivz
-
-		for interseg_frame_index in range(seg.frames):
-			wait_available_thread_slots(1)
-
-			frame_filename = glob.img_base_name + f"{frame_index:06d}" + glob.img_suffix
-			(m, s) = bench_get_min_sec()
-			m = min(m, 999)
-			_LOG(term.title + f"\nT(left) {m:03d}:{s:02d} segm " + term.values +
-				f"{seg_index:3d}" + term.title +
-				" fr " + term.values + f"{frame_index:4d}" + term.title + ", \"" +
-				term.values + f"{frame_filename}" + term.title + "\" ... ")
-
-			if os.path.exists(frame_filename):
-				if not glob.overwrite:
-					_LOG("keeping ")
-					skip = True
-				else:
-					_LOG("re-rendering ")
-					skip = False
+def cache_init() -> None:
+	with open(glob.pcb_file, "rb") as f:
+		glob.pcb_hash = hashlib.sha256(f.read()).hexdigest()
+
+	try:
+		glob.kicad_cli_ver = subprocess.run(glob.kicad_cli_cmd + ["--version"],
+											capture_output = True, text = True).stdout.strip()
+	except OSError:
+		glob.kicad_cli_ver = "unknown"
+
+	if glob.cache_dir is None:
+		return
+	if not glob.dry_run:
+		os.makedirs(glob.cache_dir, exist_ok = True)
+	_DBG(term.title + "Cache " + term.values + glob.cache_dir + term.title + " pcb " +
+		term.values + glob.pcb_hash[:16] + term.title + " cli " + term.values +
+		glob.kicad_cli_ver + "\n")
+	return
+#/def cache_init
+
+
+# Cache file name for a frame, from the kicad-cli args that determine its
+# content, i.e. everything except --output and the input file name.
+def cache_path(args: list) -> str:
+	h = hashlib.sha256()
+	h.update(glob.pcb_hash.encode())
+	h.update(b"\0" + glob.kicad_cli_ver.encode())
+	for a in args:
+		h.update(b"\0" + a.encode())
+	key = h.hexdigest()
+	return os.path.join(glob.cache_dir, key[:2], key + glob.img_suffix)
+#/def cache_path
+
+
+# Make dst refer to src. Hardlink if possible, else symlink, else copy.
+def cache_link(src: str, dst: str) -> None:
+	if os.path.lexists(dst):
+		os.remove(dst)
+	try:
+		os.link(src, dst)
+	except OSError:
+		try:
+			os.symlink(os.path.abspath(src), dst)
+		except OSError:
+			shutil.copyfile(src, dst)
+	return
+#/def cache_link
+
+
+# Remove least recently used cache entries until the cache fits cache_max_mb.
+# Entries used in this run are never removed.
+def cache_evict() -> None:
+	if glob.cache_dir is None or glob.dry_run or not os.path.isdir(glob.cache_dir):
+		return
+
+	entries = []
+	total = 0
+	for dirpath, dirnames, filenames in os.walk(glob.cache_dir):
+		for fn in filenames:
+			fp = os.path.join(dirpath, fn)
+			st = os.stat(fp)
+			entries.append((st.st_mtime, st.st_size, fp))
+			total += st.st_size
+
+	limit = glob.cache_max_mb * 1024 * 1024
+	removed = 0
+	for mtime, size, fp in sorted(entries):
+		if total <= limit:
+			break
+		if fp in glob.cache_used:
+			continue
+		os.remove(fp)
+		total -= size
+		removed += 1
+
+	if removed > 0:
+		_LOG(term.title + "Cache: evicted " + term.values + f"{removed}" + term.title +
+			" frames, " + term.values + f"{total / (1024 * 1024):.1f}" + term.title + " MB left\n")
+	return
+#/def cache_evict
+
+
+# The kicad-cli args of a pose, joined by "\0". Together with
+# frame_static_args() they are the args determining the content of one frame,
+# i.e. all except --output and the input file.
+def frame_pose_key(incl_pan: bool, incl_piv: bool, zoom, rotax, rotay, rotaz,
+					panax, panay, panaz, pivx, pivy, pivz) -> str:
+	key = f"--zoom\0{zoom:.3f}"
+	if incl_pan:
+		key += f"\0--pan\0'{panax:.2f},{panay:.2f},{panaz:.2f}'"
+	if incl_piv:
+		key += f"\0--pivot\0'{pivx:.2f},{pivy:.2f},{pivz:.2f}'"
+	return key + f"\0--rotate\0'{rotax:.2f},{rotay:.2f},{rotaz:.2f}'"
+#/def frame_pose_key
+
+
+# kicad-cli args following the pose args, the same for all frames.
+def frame_static_args() -> list:
+	arglist = list()
+	arglist.append("--width")
+	arglist.append(f"{glob.vid_dx}")
+	arglist.append("--height")
+	arglist.append(f"{glob.vid_dy}")
+
+	arglist.append("--background")
+	arglist.append(glob.kc_background)
+	if glob.kc_floor:
+		arglist.append("--floor")
+	if glob.kc_perspective:
+		arglist.append("--perspective")
+	arglist.append("--preset")
+	arglist.append(glob.kc_preset)
+	arglist.append("--quality")
+	arglist.append(glob.kc_quality)
+	return arglist
+#/def frame_static_args
+
+
+# y of the cubic bezier easing curve (0,0), (x1,y1), (x2,y2), (1,1) at x = t.
+def ease_bezier(ease: tuple, t: float) -> float:
+	x1, y1, x2, y2 = ease
+	def bez(p1, p2, s):
+		return 3 * (1 - s) * (1 - s) * s * p1 + 3 * (1 - s) * s * s * p2 + s * s * s
+
+	lo, hi, s = 0.0, 1.0, t					# Newton, falling back to bisection.
+	for n in range(20):
+		x = bez(x1, x2, s) - t
+		if abs(x) < 1e-9:
+			break
+		if x > 0:
+			hi = s
+		else:
+			lo = s
+		dx = 3 * (1 - s) * (1 - s) * x1 + 6 * (1 - s) * s * (x2 - x1) + 3 * s * s * (1 - x2)
+		s = s - x / dx if dx > 1e-6 else (lo + hi) / 2
+		if not lo <= s <= hi:
+			s = (lo + hi) / 2
+	return bez(y1, y2, s)
+#/def ease_bezier
+
+
+# Uniform Catmull-Rom spline through pts, evaluated at each u in [0, 1], with
+# the pts evenly spaced in u. Exact at the pts.
+def catmull_rom(pts: list, u_list: list) -> list:
+	m = len(pts) - 1
+	out = []
+	for u in u_list:
+		x = u * m
+		k = min(int(x), m - 1)
+		f = x - k
+		p0, p1, p2 = pts[max(k - 1, 0)], pts[k], pts[k + 1]
+		p3 = pts[min(k + 2, m)]
+		out.append(pts[m] if f == 1 and k == m - 1 else
+					0.5 * (2 * p1 + (p2 - p0) * f + (2 * p0 - 5 * p1 + 4 * p2 - p3) * f * f +
+							(3 * p1 - p0 - 3 * p2 + p3) * f * f * f))
+	return out
+#/def catmull_rom
+
+
+# Poses of all frames. Between two poses it's fr * (1 - u) + to * u so both
+# ends are exact and nothing accumulates, with keyframes a Catmull-Rom spline
+# through all of them. u is t through the segment's easing curve. t runs over
+# [0, 1) if the next segment starts where this one ends, so the shared pose
+# isn't rendered twice, otherwise over [0, 1] so the segment ends on its
+# "toward" pose. Rotations are kept within [-360, 360].
+def frame_table(segments: list) -> FrameTable:
+	table = FrameTable()
+
+	for seg_index in range(len(segments)):
+		seg = segments[seg_index]
+		n = seg.frames
+		if n <= 0:
+			continue
+
+		nxt = segments[seg_index + 1] if seg_index + 1 < len(segments) else None
+		continues = nxt is not None and all(
+			getattr(nxt, "fr_" + c) == getattr(seg, "to_" + c) for c in POSE_COLS)
+		den = n if (continues or n == 1) else n - 1
+		t = [i / den for i in range(n)]
+		if seg.ease is not None:
+			t = [ease_bezier(seg.ease, ti) for ti in t]
+
+		table.seg_index.extend(array.array("i", [seg_index]) * n)
+		for ci in range(len(POSE_COLS)):
+			c = POSE_COLS[ci]
+			pts = ([getattr(seg, "fr_" + c)] + [k[ci] for k in seg.keys] +
+					[getattr(seg, "to_" + c)])
+			if seg.rot_short and c in ROT_COLS:
+				for k in range(1, len(pts)):	# Each step within (-180, 180].
+					d = math.fmod(pts[k] - pts[k - 1], 360)
+					d = d - 360 if d > 180 else d + 360 if d <= -180 else d
+					pts[k] = pts[k - 1] + d
+
+			if all(p == pts[0] for p in pts):
+				col = array.array("d", [pts[0]]) * n
+			elif len(pts) == 2:
+				fr, to = pts
+				col = array.array("d", [fr * (1 - ti) + to * ti for ti in t])
 			else:
-				_LOG("rendering ")
-				skip = False
-			# /if
-
-			arglist = list()
-			arglist.extend(cli_static_args)
-			arglist.append("--zoom")
-			arglist.append(f"{zoom:.3f}")
-			if seg.incl_pan:
-				arglist.append("--pan")
-				arglist.append(f"'{panax:.2f},{panay:.2f},{panaz:.2f}'")
-			if seg.incl_piv:
-				arglist.append("--pivot")
-				arglist.append(f"'{pivx:.2f},{pivy:.2f},{pivz:.2f}'")
-			arglist.append("--rotate")
-			arglist.append(f"'{rotax:.2f},{rotay:.2f},{rotaz:.2f}'")
-			arglist.append("--width")
-			arglist.append(f"{glob.vid_dx}")
-			arglist.append("--height")
-			arglist.append(f"{glob.vid_dy}")
-
-			arglist.append("--background")
-			arglist.append(glob.kc_background)
-			if glob.kc_floor:
-				arglist.append("--floor")
-			if glob.kc_perspective:
-				arglist.append("--perspective")
-			arglist.append("--preset")
-			arglist.append(glob.kc_preset)
-			arglist.append("--quality")
-			arglist.append(glob.kc_quality)
-
-			arglist.append("--output")
-			arglist.append(f"{frame_filename}")
-			arglist.append(f"{glob.pcb_file}")
-			_DBG(term.values + str(arglist))
-			if not skip:
-				if not glob.dry_run:
-					run_thread(glob.kicad_cli_exe, arglist)
-
-			zoom += seg.d_zoom
-			rotax += seg.d_rotax
-			rotay += seg.d_rotay
-			rotaz += seg.d_rotaz
-			panax += seg.d_panax
-			panay += seg.d_panay
-			panaz += seg.d_panaz
-			pivx += seg.d_pivx
-			pivy += seg.d_pivy
-			pivz += seg.d_pivz
-
-			frame_index += 1
-			bench_update(1)
-	_LOG("\n")
+				col = array.array("d", catmull_rom(pts, t))
+
+			if c in ROT_COLS and (min(col) < -360 or max(col) > 360):
+				col = array.array("d", [math.fmod(v, 360) for v in col])
+			table.cols[c].extend(col)
+	return table
+#/def frame_table
+
+
+# Write the frame table as CSV, for inspection.
+def dump_frame_table(table: FrameTable, filename: str) -> None:
+	with open(filename, "w", newline = "") as f:
+		w = csv.writer(f)
+		w.writerow(("frame", "segment") + POSE_COLS)
+		for i in range(len(table)):
+			w.writerow((i, table.seg_index[i]) + tuple(f"{v:.6f}" for v in table.pose(i)))
 	return
+#/def dump_frame_table
 
 
-def create_video_file() -> None:
-	# TODO	Make some of the ffmpeg options configurable with cmdline args.
-	ff_static_args_1 = ["-y", "-start_number", "0"]
-	ff_static_args_2 = ["-c:v", "libx264", "-preset", "slow", "-crf", "22"]
+# Only every Nth frame of the video is included if every > 1, numbered
+# consecutively. With --plan, the poses are those of the plan file.
+def plan_frames(every: int = 1) -> RenderPlan:
+	if glob.plan_given is not None or glob.plan_file is not None:
+		loaded = glob.plan_given or plan_load(glob.plan_file)
+		glob.vid_fps = loaded.fps
+		table, seg_incl = loaded.table, loaded.seg_incl
+	else:
+		loaded = None
+		table = frame_table(glob.segments)
+		seg_incl = [(seg.incl_pan, seg.incl_piv) for seg in glob.segments]
 
-	if glob.out_file != None:
-		_LOG(term.title + "\nCreating video file... ")
+	if loaded is not None and every == 1:
+		plan = replace(loaded, static = frame_static_args())
+	else:
+		plan = RenderPlan(table = table, seg_incl = seg_incl, static = frame_static_args(),
+							fps = glob.vid_fps)
+		groups = {}
+		cols = [table.cols[c] for c in POSE_COLS]
+		for row in range(0, len(table), every):
+			seg_index = table.seg_index[row]
+			key = frame_pose_key(*seg_incl[seg_index], *(col[row] for col in cols))
+			g = groups.setdefault(key, len(groups))
+			if g == len(plan.keys):
+				plan.keys.append(key)
+			plan.rows.append(row)
+			plan.seg_index.append(seg_index)
+			plan.group.append(g)
+
+	_LOG(term.title + "Plan: " + term.values + f"{len(plan)}" + term.title +
+		" frames, " + term.values + f"{len(plan.keys)}" + term.title + " unique\n")
+	return plan
+#/def plan_frames
+
+
+PLAN_MAGIC = b"anim_pcb plan 1\n"
+
+# Write the plan to a binary file: PLAN_MAGIC, then zlib compressed a JSON
+# header line, the arrays of the plan as they are in memory and the group keys.
+def plan_save(plan: RenderPlan, filename: str) -> None:
+	arrays = ([plan.table.seg_index] + [plan.table.cols[c] for c in POSE_COLS] +
+				[plan.rows, plan.seg_index, plan.group])
+	head = {"byteorder": sys.byteorder, "int_size": plan.rows.itemsize, "fps": plan.fps,
+			"cols": POSE_COLS, "table_rows": len(plan.table), "frames": len(plan),
+			"seg_incl": plan.seg_incl}
+	body = (json.dumps(head).encode() + b"\n" + b"".join(a.tobytes() for a in arrays) +
+			"\n".join(plan.keys).encode())
+
+	tmp = filename + ".tmp"
+	with open(tmp, "wb") as f:
+		f.write(PLAN_MAGIC + zlib.compress(body))
+	os.replace(tmp, filename)
+	return
+#/def plan_save
 
-		arglist = list()
-		arglist.extend(ff_static_args_1)
-		arglist.append("-framerate")
-		arglist.append(f"{glob.vid_fps}")
-		arglist.append("-i")
-		arglist.append(glob.img_base_name + "%06d" + glob.img_suffix)
-		arglist.append("-frames:v")
-		arglist.append(f"{glob.vid_frames}")
-		arglist.extend(ff_static_args_2)
-		arglist.append("-r")
-		arglist.append(f"{glob.vid_fps}")
-		arglist.append(glob.out_file)
 
-		_DBG(term.values + str(arglist))
+def plan_load(filename: str) -> RenderPlan:
+	try:
+		with open(filename, "rb") as f:
+			data = f.read()
+		if not data.startswith(PLAN_MAGIC):
+			raise ValueError("not a plan file")
+		head, _, body = zlib.decompress(data[len(PLAN_MAGIC):]).partition(b"\n")
+		head = json.loads(head)
+		if tuple(head["cols"]) != POSE_COLS or head["int_size"] != array.array("i").itemsize:
+			raise ValueError("plan file of another version")
+
+		pos = 0
+		def take(typecode: str, n: int) -> array.array:
+			nonlocal pos
+			a = array.array(typecode)
+			a.frombytes(body[pos:pos + n * a.itemsize])
+			if len(a) != n:
+				raise ValueError("truncated")
+			if head["byteorder"] != sys.byteorder:
+				a.byteswap()
+			pos += n * a.itemsize
+			return a
+		#/def take
+
+		plan = RenderPlan(table = FrameTable(), fps = head["fps"],
+							seg_incl = [tuple(s) for s in head["seg_incl"]])
+		plan.table.seg_index = take("i", head["table_rows"])
+		for c in POSE_COLS:
+			plan.table.cols[c] = take("d", head["table_rows"])
+		plan.rows = take("i", head["frames"])
+		plan.seg_index = take("i", head["frames"])
+		plan.group = take("i", head["frames"])
+		plan.keys = body[pos:].decode().split("\n") if pos < len(body) else []
+	except (OSError, ValueError, KeyError, zlib.error) as e:
+		err_exit(term.err + "***ERROR*** cannot read plan " + term.errdata + filename +
+			term.err + ": " + str(e) + term.normal + "\n")
+	return plan
+#/def plan_load
+
+
+def frame_filename(frame_index: int) -> str:
+	return glob.img_base_name + f"{frame_index:06d}" + glob.img_suffix
+
+
+# Link every frame in frames to the rendered image src. Frames equal to src are left alone.
+def link_frames(src: str, frames: list) -> None:
+	for i in frames:
+		dst = frame_filename(i)
+		if dst != src:
+			cache_link(src, dst)
+	return
+#/def link_frames
+
+
+# Make the renames and links in the directories of the given files durable,
+# before the journal says they are done.
+def dir_sync(*filenames: str) -> None:
+	for d in {os.path.dirname(f) or "." for f in filenames}:
+		try:
+			fd = os.open(d, os.O_RDONLY)
+		except OSError:
+			continue
+		try:
+			os.fsync(fd)
+		except OSError:						# Not supported by every file system.
+			pass
+		finally:
+			os.close(fd)
+	return
+#/def dir_sync
+
+
+# Move a completed render from its partial file into place (the cache or the
+# first frame of the group) and link all frames of the group to it. Renders
+# that failed leave nothing behind.
+def frame_rendered(ok: bool, partial: str, final: str, frames: list) -> None:
+	if not ok:
+		if os.path.exists(partial):
+			os.remove(partial)
+		journal_write("failed", frames)
+		return
+	with open(partial, "rb") as f:			# On disk before it gets its final name.
+		data = f.read()
+		os.fsync(f.fileno())
+	os.replace(partial, final)
+	link_frames(final, frames)
+	dir_sync(final, frame_filename(frames[0]))
+	journal_write("done", frames, size = len(data), crc = zlib.crc32(data))
+	cache_release(final, True)
+	frames_ready(frames)
+	return
+#/def frame_rendered
+
+
+# Cheap structural check that an image file was written completely: the
+# format's signature at the start and its end marker at the end.
+def image_complete(filename: str) -> bool:
+	try:
+		with open(filename, "rb") as f:
+			head = f.read(8)
+			f.seek(max(0, os.fstat(f.fileno()).st_size - 12))
+			tail = f.read(12)
+	except OSError:
+		return False
+	if head.startswith(b"\x89PNG\r\n\x1a\n"):
+		return tail.endswith(b"IEND\xaeB`\x82")
+	if head.startswith(b"\xff\xd8"):
+		return tail.endswith(b"\xff\xd9")
+	return False
+#/def image_complete
+
+
+# Each pass keeps an append-only journal of JSON lines next to its frames:
+#	{"ev": "plan", "hash": ...}						args of all frames, in order
+#	{"ev": "start"|"done"|"failed", "frames": [...], "size": ..., "crc": ...}
+# Records are fsync'ed, a torn last line is ignored. With --resume, the done
+# records of the same plan are kept (rewritten atomically by temp file and
+# rename) and those frames are not looked at again, as long as their files
+# are still there.
+def journal_open() -> None:
+	if glob.dry_run:
+		return
+	filename = glob.img_base_name + "journal.jsonl"
+	h = hashlib.sha256()
+	h.update("\0".join(glob.plan.static).encode() + b"\n")
+	for key in glob.plan.keys:
+		h.update(key.encode() + b"\n")
+	h.update(glob.plan.group.tobytes())
+	plan_hash = h.hexdigest()
+
+	glob.journal_done = set()
+	kept = []
+	if glob.resume and os.path.exists(filename):
+		same_plan = False
+		with open(filename) as f:
+			for line in f:
+				try:
+					rec = json.loads(line)
+				except ValueError:			# Torn write.
+					continue
+				if rec.get("ev") == "plan":
+					same_plan = rec.get("hash") == plan_hash
+				elif rec.get("ev") == "done" and same_plan:
+					kept.append(line if line.endswith("\n") else line + "\n")
+					glob.journal_done.update(rec["frames"])
+		if glob.journal_done:				# One listdir(), not a stat() per frame.
+			img_dir = os.path.dirname(glob.img_base_name) or "."
+			present = set(os.listdir(img_dir)) if os.path.isdir(img_dir) else set()
+			missing = {i for i in glob.journal_done
+						if os.path.basename(frame_filename(i)) not in present}
+			if missing:
+				_LOG(term.title + "Journal: " + term.values + f"{len(missing)}" + term.title +
+					" frames done but missing, rendering them again\n")
+				glob.journal_done -= missing
+		_LOG(term.title + "Journal: " + term.values + f"{len(glob.journal_done)}" + term.title +
+			" frames done\n")
+
+	os.makedirs(os.path.dirname(filename) or ".", exist_ok = True)
+	tmp = filename + ".tmp"
+	with open(tmp, "w") as f:
+		f.write(json.dumps({"ev": "plan", "hash": plan_hash, "frames": len(glob.plan)}) + "\n")
+		f.writelines(kept)
+		f.flush()
+		os.fsync(f.fileno())
+	os.replace(tmp, filename)
+	glob.journal_file = open(filename, "a")
+	return
+#/def journal_open
+
+
+def journal_write(ev: str, frames: list, **kw) -> None:
+	if glob.journal_file is None:
+		return
+	glob.journal_file.write(json.dumps({"ev": ev, "frames": frames, **kw}) + "\n")
+	glob.journal_file.flush()
+	os.fsync(glob.journal_file.fileno())
+	return
+#/def journal_write
+
+
+def journal_close() -> None:
+	if glob.journal_file is not None:
+		glob.journal_file.close()
+		glob.journal_file = None
+	glob.journal_done = set()
+	return
+#/def journal_close
+
+
+def log_frames(frames: list, what: str) -> None:
+	if glob.progress != "frames":
+		progress_tick()
+		return
+	if glob.remain_sec is None:
+		t_left = "---:--"
+	else:
+		(m, s) = bench_get_min_sec()
+		t_left = f"{min(m, 999):03d}:{s:02d}"
+	_LOG(term.title + f"\nT(left) {t_left} segm " + term.values +
+		f"{glob.plan.seg_index[frames[0]]:3d}" + term.title +
+		" fr " + term.values + f"{frames[0]:4d}" + term.title + ", \"" +
+		term.values + f"{frame_filename(frames[0])}" + term.title + "\" ")
+	if len(frames) > 1:
+		_LOG(term.title + "+" + term.values + f"{len(frames) - 1}" + term.title + " dup ")
+	_LOG(term.title + "... " + what)
+	return
+#/def log_frames
+
+
+# Progress of the current pass: frames done, running, waiting and failed,
+# frames/s, ETA, and what every job slot and, as coordinator, every worker is
+# working on.
+def progress_state() -> dict:
+	now = time.monotonic()
+	slots = [{"frame": po.job.frames[0], "sec": round(now - po.t_start, 1)}
+				for po in glob.proc_list if po.glob is glob and po.job is not None]
+	workers = {}
+	if glob.coord_server is not None:
+		with glob.coord_lock:
+			for worker, seen in glob.coord_workers.items():
+				workers[worker] = {"frames": 0, "seen_sec": round(now - seen, 1)}
+			for job in glob.coord_jobs:
+				if job.state == "assigned" and job.worker in workers:
+					workers[job.worker]["frames"] += 1
+
+	elapsed = now - glob.start_sec
+	fps = glob.frames_done / elapsed if elapsed > 0 else 0
+	eta = glob.remain_sec
+	if eta is None and fps > 0:
+		eta = glob.frames_left / fps
+	return {"done": glob.frames_done, "total": glob.vid_frames, "running": len(slots),
+			"waiting": len(glob.todo) + len(glob.retry_q), "failed": len(glob.failed_frames),
+			"fps": round(fps, 2), "eta_sec": None if eta is None else round(eta),
+			"elapsed_sec": round(elapsed, 1), "slots": slots, "workers": workers}
+#/def progress_state
+
+
+# Report the progress if --progress-interval has passed since the last time,
+# or anyway if final: as a line rewritten in place on a terminal, as a log
+# line or as a JSON line.
+def progress_tick(final: bool = False) -> None:
+	if glob.progress in ("frames", "quiet") or glob.start_sec is None:
+		return
+	now = time.monotonic()
+	if not final and now - glob.progress_at < glob.progress_every:
+		return
+	glob.progress_at = now
+	st = progress_state()
+
+	if glob.progress == "json":
+		rec = {"ev": "end" if final else "progress", "t": round(time.time(), 3)}
+		if glob.batch_state is not None:
+			rec["job"] = glob.batch_index
+		_LOG(json.dumps({**rec, **st}) + "\n")
+		return
+
+	if st["eta_sec"] is None:
+		t_left = "---:--"
+	else:
+		(m, s) = divmod(st["eta_sec"], 60)
+		t_left = f"{min(m, 999):03d}:{s:02d}"
+	line = (term.title + "T(left) " + term.values + t_left + term.title + " frames " +
+			term.values + f"{st['done']}/{st['total']}" + term.title + " running " +
+			term.values + f"{st['running']}" + term.title + " waiting " + term.values +
+			f"{st['waiting']}" + term.title + " failed " + term.values + f"{st['failed']}" +
+			term.title + " @ " + term.values + f"{st['fps']:.2f}" + term.title + " fr/s")
+	if st["slots"]:
+		oldest = max(st["slots"], key = lambda slot: slot["sec"])
+		line += (term.title + ", longest fr " + term.values + f"{oldest['frame']}" +
+				term.title + " for " + term.values + f"{oldest['sec']:.0f}" + term.title + "s")
+	if st["workers"]:
+		busy = sum(1 for w in st["workers"].values() if w["frames"])
+		line += (term.title + ", workers " + term.values + f"{busy}/{len(st['workers'])}" +
+				term.title + " busy")
+	if glob.batch_state is not None:
+		line = term.title + "Job " + term.values + f"{glob.batch_index}" + " " + line
+
+	if glob.progress == "tty":
+		_LOG("\r" + line + term.normal + "\033[K" + ("\n" if final else ""))
+	else:
+		_LOG(line + term.normal + "\n")
+	return
+#/def progress_tick
+
+
+# Go through every unique frame of the plan. Frames done according to the
+# journal, in the cache or kept are finished right away, the others are
+# returned as FrameJobs to be rendered.
+def triage_frames() -> list:
+	todo = []
+	filled_clear()
+
+	for group, frames in enumerate(glob.plan.groups()):
+		args = glob.plan.group_argv(group)
+		first_filename = frame_filename(frames[0])
+		if glob.cache_dir is not None:
+			final_filename = cache_path(args)
+			glob.cache_used.add(final_filename)
+		else:
+			final_filename = first_filename
+
+		if frames[0] in glob.interp_frames:	# See interp_plan().
+			continue
+
+		if glob.journal_done.issuperset(frames) and not glob.stream_delete:
+			log_frames(frames, "journaled ")	# Trust the journal, don't touch the files.
+			frames_ready(frames)
+			bench_update(len(frames))
+			continue
+
+		corrupt = ""
+		if glob.resume and os.path.exists(final_filename) and not image_complete(final_filename):
+			corrupt = "corrupt "
+			os.remove(final_filename)
+
+		if not os.path.exists(final_filename):
+			what = "rendering "
+		elif glob.overwrite:
+			what = "re-rendering "
+		elif glob.cache_dir is not None:
+			what = "cached "
+			glob.cache_hits += 1
+			if not glob.dry_run:
+				os.utime(final_filename)		# mtime is the LRU timestamp
+		else:
+			what = "keeping "
+
+		if what in ("cached ", "keeping "):
+			log_frames(frames, what)
+			if not glob.dry_run:
+				link_frames(final_filename, frames)
+				dir_sync(final_filename, frame_filename(frames[0]))
+				journal_write("done", frames, size = os.path.getsize(final_filename))
+				frames_ready(frames)
+			bench_update(len(frames))
+			quarantine_release(args)
+		elif quarantined(args):
+			log_frames(frames, "quarantined ")
+			glob.failed_frames.update(frames)
+			bench_update(len(frames))
+		else:
+			job = FrameJob(group, frames,
+				final_filename + ".partial" + glob.img_suffix, final_filename, corrupt + what)
+			if not cache_wait(job):
+				todo.append(job)
+	return todo
+#/def triage_frames
+
+
+# In --batch mode, jobs with the same board and poses share cache files. The
+# first job to need one renders it, the others wait for it here instead of
+# rendering it again into the same partial file. Returns True if job waits.
+def cache_wait(job: FrameJob) -> bool:
+	if glob.cache_dir is None or glob.dry_run:
+		return False
+	waiters = glob.cache_inflight.get(job.final)
+	if waiters is None:
+		glob.cache_inflight[job.final] = []
+		return False
+	waiters.append((glob, job))
+	glob.cache_waiting += 1
+	log_frames(job.frames, "waiting for ")
+	return True
+#/def cache_wait
+
+
+# The cache file final has been rendered, or given up on. The jobs waiting for
+# it link their frames to it, or the first of them renders it itself.
+def cache_release(final: str, ok: bool) -> None:
+	waiters = glob.cache_inflight.pop(final, None)
+	if not waiters:
+		return
+	if not ok:
+		g, job = waiters.pop(0)
+		glob.cache_inflight[final] = waiters
+		g.cache_waiting -= 1
+		g.todo.append(job)
+		return
+	for g, job in waiters:
+		glob_call(g, cache_waited, job)
+	return
+#/def cache_release
+
+
+def cache_waited(job: FrameJob) -> None:
+	glob.cache_waiting -= 1
+	glob.cache_hits += 1
+	log_frames(job.frames, "cached ")
+	link_frames(job.final, job.frames)
+	dir_sync(job.final, frame_filename(job.frames[0]))
+	journal_write("done", job.frames, size = os.path.getsize(job.final))
+	frames_ready(job.frames)
+	bench_update(len(job.frames))
+	return
+#/def cache_waited
+
+
+# Sort todo into the --order to render it in, from the end as it's popped from
+# there. --order cost is sorted as costs become known, see next_job().
+def order_todo() -> None:
+	todo = glob.todo
+	if glob.order == "interleave":
+		# Every order_step-th frame, then each halfway between those, and so on.
+		step = glob.order_step
+		def level(f: int) -> int:
+			k, s = 0, step
+			while s > 1 and f % s:
+				k, s = k + 1, s // 2
+			return k
+		#/def level
+		todo.sort(key = lambda job: (level(job.frames[0]), job.frames[0]), reverse = True)
+	elif glob.order == "segment":
+		# Round robin over the segments, each in order.
+		start = {}
+		for i, seg_index in enumerate(glob.plan.seg_index):
+			start.setdefault(seg_index, i)
+		todo.sort(key = lambda job: (job.frames[0] - start[glob.plan.seg_index[job.frames[0]]],
+									glob.plan.seg_index[job.frames[0]]), reverse = True)
+	else:
+		todo.sort(key = lambda job: job.frames[0], reverse = True)
+	return
+#/def order_todo
+
+
+# Next job to start, from the end of todo, see order_todo(). With --order cost
+# the one with the highest predicted cost. Until there are predictions, frames
+# spread evenly over the video are sampled first.
+def next_job():
+	todo = glob.todo
+	if glob.order != "cost":
+		return todo.pop()
+
+	n = len(glob.cost_idx)
+	if glob.cost_sorted_at == 0 or n >= glob.cost_sorted_at + max(glob.max_threads, n // 10):
+		if n == 0:
+			todo.sort(key = lambda job: -van_der_corput(job.frames[0]))
+		else:
+			todo.sort(key = lambda job: cost_predict(job.frames[0]))
+		glob.cost_sorted_at = max(n, 1)
+	return todo.pop()
+#/def next_job
+
+
+# Radical inverse of i in base 2: 0, .5, .25, .75, ... spreads samples evenly.
+def van_der_corput(i: int) -> float:
+	v, f = 0.0, 0.5
+	while i:
+		v += f * (i & 1)
+		i >>= 1
+		f /= 2
+	return v
+#/def van_der_corput
+
+
+def frame_done_local(po: subprocess.Popen, job: FrameJob) -> None:
+	frame_rendered(po.returncode == 0, job.partial, job.final, job.frames)
+	telemetry_record(po, job.final, job.frames)
+	if po.returncode == 0:
+		cost_record(job.frames[0], po.t_end - po.t_start)
+		bench_update(len(job.frames))
+		quarantine_release(glob.plan.group_argv(job.group))
+		return
+
+	job.tries += 1
+	if job.tries <= glob.retries:
+		delay = glob.retry_backoff * 2 ** (job.tries - 1)
+		_LOG(term.err + "\nframe " + f"{job.frames[0]}" + " failed, retry " + f"{job.tries}" +
+			" in " + f"{delay:.0f}" + "s" + term.normal)
+		heapq.heappush(glob.retry_q, (time.monotonic() + delay, id(job), job))
+		job.what = "retrying "
+	else:
+		frame_given_up(glob.plan.group_argv(job.group), job.frames, job.final)
+	return
+#/def frame_done_local
+
+
+# Frames failed all retries: remember them, and the pose in the quarantine.
+def frame_given_up(args: list, frames: list, final: str) -> None:
+	_LOG(term.err + "\nframe " + f"{frames[0]}" + " failed, giving up" + term.normal)
+	glob.failed_frames.update(frames)
+	bench_update(len(frames))
+	cache_release(final, False)
+
+	key = quarantine_key(args)
+	entry = glob.quarantine.setdefault(key, {"fails": 0, "args": args})
+	if entry.get("run") != glob.quarantine_run:	# Runs are counted, not tries.
+		entry["fails"] += 1
+		entry["run"] = glob.quarantine_run
+		quarantine_save()
+	return
+#/def frame_given_up
+
+
+QUARANTINE_RUNS = 2		# runs a pose must fail in before it's skipped, see quarantined()
+
+
+def quarantine_filename() -> str:
+	return os.path.join(glob.tmp_dir, "anim_pcb_quarantine.json")
 
+
+# The board, the kicad-cli version (an update may fix it) and the pose.
+def quarantine_key(args: list) -> str:
+	return hashlib.sha256((glob.pcb_hash + "\0" + glob.kicad_cli_ver + "\0" +
+							"\0".join(args)).encode()).hexdigest()
+
+
+# Is the pose skipped? Only once it has failed all retries in QUARANTINE_RUNS
+# runs, as a single run may have hit a passing problem within seconds.
+def quarantined(args: list) -> bool:
+	entry = glob.quarantine.get(quarantine_key(args))
+	return (entry is not None and entry["fails"] >= QUARANTINE_RUNS and
+			not glob.retry_quarantined)
+#/def quarantined
+
+
+def quarantine_load() -> None:
+	glob.quarantine_run = os.urandom(8).hex()
+	glob.quarantine = {}
+	try:
+		with open(quarantine_filename()) as f:
+			glob.quarantine = json.load(f)
+	except (OSError, ValueError):
+		pass
+	return
+#/def quarantine_load
+
+
+def quarantine_save() -> None:
+	if glob.dry_run:
+		return
+	tmp = quarantine_filename() + ".tmp"
+	with open(tmp, "w") as f:
+		json.dump(glob.quarantine, f, indent = 1)
+	os.replace(tmp, quarantine_filename())
+	return
+#/def quarantine_save
+
+
+# A quarantined pose has been rendered after all, e.g. with --retry-quarantined.
+def quarantine_release(args: list) -> None:
+	if glob.quarantine.pop(quarantine_key(args), None) is not None:
+		quarantine_save()
+	return
+#/def quarantine_release
+
+
+def filled_filename() -> str:
+	return glob.img_base_name + "filled.json"
+
+
+# Frames filled in by --fill-failed in an earlier run are links to another
+# frame. Remove them, so they are rendered again (or fail and are filled again)
+# instead of being kept, or taken as proof that a quarantined pose renders.
+def filled_clear() -> None:
+	if glob.dry_run:
+		return
+	try:
+		with open(filled_filename()) as f:
+			filled = json.load(f)
+	except (OSError, ValueError):
+		return
+	for i in filled:
+		fn = frame_filename(i)
+		if os.path.lexists(fn):
+			os.remove(fn)
+	glob.journal_done.difference_update(filled)
+	os.remove(filled_filename())
+	return
+#/def filled_clear
+
+
+# Link each failed frame to the nearest frame that didn't fail, preferring
+# the one before it, and note them in filled_filename(). Returns False if there
+# is none.
+def fill_failed_frames() -> bool:
+	failed = glob.failed_frames
+	good = [i for i in range(len(glob.plan)) if i not in failed]
+	if not good:
+		return False
+	_LOG("\n")
+	for i in sorted(failed):
+		j = bisect.bisect_left(good, i)
+		src = good[j - 1] if j > 0 else good[j]
+		_LOG(term.err + "frame " + f"{i}" + " filled with frame " + f"{src}" + term.normal + "\n")
 		if not glob.dry_run:
-			run_thread(glob.ffmpeg_exe, arglist)
+			cache_link(frame_filename(src), frame_filename(i))
+	if not glob.dry_run:
+		tmp = filled_filename() + ".tmp"
+		with open(tmp, "w") as f:
+			json.dump(sorted(failed), f)
+		os.replace(tmp, filled_filename())
+		frames_ready(sorted(failed))
+	return True
+#/def fill_failed_frames
+
+
+# Set up rendering the frames of the plan, see render_dispatch().
+def render_begin() -> None:
+	glob.tmp_inodes, glob.tmp_bytes, glob.tmp_peak, glob.disk_deferred = {}, 0, 0, 0
+	glob.failed_frames = set()
+	glob.retry_q = []
+	interp_plan()
+	glob.todo = triage_frames()
+	order_todo()
+	glob.cost_sorted_at = 0
+	glob.tile_q.clear()
 	return
+#/def render_begin
+
+
+# Start rendering the next frame that is due, or hand it to the coordinator.
+# Returns False if there is none now.
+def render_dispatch() -> bool:
+	if glob.tile_q:
+		tile_start(*glob.tile_q.popleft())
+		return True
+	if glob.interp_q:
+		interp_start(glob.interp_q.popleft())
+		return True
+
+	now = time.monotonic()
+	while glob.retry_q and glob.retry_q[0][0] <= now:
+		glob.todo.append(heapq.heappop(glob.retry_q)[2])
+	if not glob.todo:
+		return False
+	job = next_job()
+
+	log_frames(job.frames, job.what)
+	args = glob.plan.group_argv(job.group)	# Built only now, see triage_frames().
+	arglist = args + ["--output", job.partial, glob.pcb_render]
+	if glob.debug_mode:
+		_DBG(term.values + str(arglist))
+	if glob.dry_run:
+		bench_update(len(job.frames))
+		return True
+
+	os.makedirs(os.path.dirname(job.partial) or ".", exist_ok = True)
+	journal_write("start", job.frames)
+	if glob.coord_addr is not None:
+		coord_submit(args, job.partial, job.final, job.frames)
+	elif glob.tiles > 1:
+		tile_expand(job)
+		if glob.tile_q:
+			tile_start(*glob.tile_q.popleft())
+	else:
+		po = run_render(arglist, lambda po, job = job: frame_done_local(po, job), glob.frame_timeout)
+		po.job = job
+	return True
+#/def render_dispatch
+
+
+# Wait for the scheduler, at most until the first of the retries is due.
+def render_wait(retry_at: float = None) -> None:
+	wake_at = retry_at
+	if glob.progress in ("tty", "log", "json") and glob.batch_file is None:
+		due = glob.progress_at + glob.progress_every
+		wake_at = due if wake_at is None else min(wake_at, due)
+	glob.sched_t0 = time.process_time()
+	sched_wait(max(0, wake_at - time.monotonic()) if wake_at is not None else None)
+	glob.sched_cpu_sec += time.process_time() - glob.sched_t0
+	if glob.batch_file is None:
+		progress_tick()
+	return
+#/def render_wait
+
+
+# All frames have been dispatched and finished. Returns True if any frame
+# failed and wasn't filled in.
+def render_end() -> bool:
+	if glob.coord_addr is not None:
+		coord_run()
+	for g, (a, b, between) in enumerate(glob.interp_gaps):
+		if g not in glob.interp_finished:	# A key frame failed.
+			glob.failed_frames.update(between)
+	progress_tick(final = True)
+	if glob.failed_frames and glob.fill_failed:
+		return not fill_failed_frames()
+	return bool(glob.failed_frames)
+#/def render_end
+
+
+# Render all frames of the plan, locally until all are done, retried or given
+# up on, or by handing them to the coordinator. Returns True if any frame failed
+# and wasn't filled in.
+def render_frames() -> bool:
+	render_begin()
+	local = glob.coord_addr is None
+
+	while True:
+		if local and not (sched_admit() and disk_admit()):
+			render_wait()
+		elif not render_dispatch():
+			if not local or not (glob.retry_q or glob.proc_list):
+				break
+			render_wait(glob.retry_q[0][0] if glob.retry_q else None)
+	_LOG("\n")
+
+	return render_end()
+#/def render_frames
+
+
+# ffmpeg output args for encoding frames frames to out_file with the --encoder
+# profile, shared by the file based and the streaming encode. passno 1 and 2 are
+# the passes of a --target-size encode, which write their stats to passlog*.
+def ff_output_args(frames: int, out_file: str, passno: int = 0, passlog: str = None) -> list:
+	(codec, preset, crf, pix_fmt, alpha_fmt, twopass) = ENC_PROFILES[glob.enc_profile]
+
+	arglist = ["-frames:v", f"{frames}", "-c:v", codec]
+	if preset is not None:
+		arglist.extend([preset[0], glob.enc_preset or preset[1]])
+	if codec == "libx265":
+		arglist.extend(["-tag:v", "hvc1"])			# playable by Apple players
+	elif codec == "libvpx-vp9":
+		arglist.extend(["-row-mt", "1"])
+	elif codec == "prores_ks":
+		arglist.extend(["-profile:v", "4444" if glob.enc_alpha else "3"])
+
+	if glob.enc_target_mb is not None:
+		arglist.extend(["-b:v", f"{enc_target_kbps()}k"])
+	elif glob.enc_bitrate is not None:
+		arglist.extend(["-b:v", glob.enc_bitrate])
+	elif crf is not None:
+		arglist.extend(["-crf", f"{glob.enc_crf if glob.enc_crf is not None else crf}"])
+		if codec == "libvpx-vp9":
+			arglist.extend(["-b:v", "0"])			# constant quality, not constrained
+	if glob.enc_gop is not None:
+		arglist.extend(["-g", f"{glob.enc_gop}"])
+	arglist.extend(["-pix_fmt", glob.enc_pix_fmt or (alpha_fmt if glob.enc_alpha else pix_fmt)])
+	arglist.extend(["-r", f"{glob.vid_fps}"])
+
+	if passno and twopass == "x265-params":
+		arglist.extend(["-x265-params", f"pass={passno}:stats={passlog}.log"])
+	elif passno:
+		arglist.extend(["-pass", f"{passno}", "-passlogfile", passlog])
+	if passno == 1:
+		arglist.extend(["-an", "-f", "null", os.devnull])
+	else:
+		arglist.append(out_file)
+	return arglist
+#/def ff_output_args
+
+
+# Video bitrate in kbit/s for --target-size, leaving 2% for the container.
+def enc_target_kbps() -> int:
+	duration = max(glob.vid_frames, 1) / glob.vid_fps
+	return max(1, int(glob.enc_target_mb * 8000 * 0.98 / duration))
+
+
+# Frame ranges (start, count) encoded separately with --encode-chunks: the
+# segments, or N about equal parts.
+def enc_chunks() -> list:
+	if glob.enc_chunks == "segments":
+		seg_index = glob.plan.seg_index
+		bounds = [i for i in range(1, glob.vid_frames) if seg_index[i] != seg_index[i - 1]]
+	else:
+		n = min(int(glob.enc_chunks), glob.vid_frames)
+		bounds = [glob.vid_frames * k // n for k in range(1, n)]
+	bounds = [0] + bounds + [glob.vid_frames]
+	return [(a, b - a) for a, b in zip(bounds, bounds[1:]) if b > a]
+#/def enc_chunks
+
+
+# Encode the numbered frames to glob.out_file. Each chunk of enc_chunks() is
+# encoded by its own ffmpeg, in one or two passes, as many at once as there are
+# free job slots, and the chunks are then joined with the concat demuxer. on_exit
+# is called with the last ffmpeg process, or the first one that failed.
+# Returns False if there is no video to create.
+def create_video_file(on_exit = None) -> bool:
+	if glob.out_file is None or glob.stream:
+		return False
+	_LOG(term.title + "\nCreating video file... ")
+
+	chunks = enc_chunks()
+	root, ext = os.path.splitext(os.path.basename(glob.out_file))
+	work = os.path.join(glob.tmp_dir, root + ".enc")
+	seqs, parts = [], []
+	for k, (start, count) in enumerate(chunks):
+		out = glob.out_file if len(chunks) == 1 else work + f".{k:03d}" + ext
+		inp = ["-y", "-start_number", f"{start}", "-framerate", f"{glob.vid_fps}",
+				"-i", glob.img_base_name + "%06d" + glob.img_suffix]
+		if glob.enc_target_mb is not None:
+			passlog = work + f".{k:03d}.passlog"
+			seqs.append([inp + ff_output_args(count, None, 1, passlog),
+						inp + ff_output_args(count, out, 2, passlog)])
+		else:
+			seqs.append([inp + ff_output_args(count, out)])
+		parts.append(out)
+
+	concat = None
+	if len(chunks) > 1:
+		concat = ["-y", "-f", "concat", "-safe", "0", "-i", work + ".list",
+					"-c", "copy", glob.out_file]
+		_LOG(term.values + f"{len(chunks)}" + term.title + " chunks ")
+	if glob.enc_target_mb is not None:
+		_LOG(term.title + "two-pass at " + term.values + f"{enc_target_kbps()}" +
+			term.title + " kbit/s ")
+	for arglist in [a for seq in seqs for a in seq] + ([concat] if concat else []):
+		_DBG("\n" + term.values + str(arglist))
+	if glob.dry_run:
+		return False
+
+	if concat is not None:
+		with open(work + ".list", "w") as f:
+			for part in parts:
+				f.write("file '" + os.path.abspath(part).replace("'", "'\\''") + "'\n")
+
+	def cleanup() -> None:
+		d = os.path.dirname(work) or "."
+		for name in os.listdir(d):
+			if name.startswith(os.path.basename(work) + "."):
+				os.remove(os.path.join(d, name))
+	#/def cleanup
+
+	pending = collections.deque(seqs)
+	state = {"running": 0, "failed": None}
+
+	def finished(po) -> None:
+		if po.returncode == 0:
+			cleanup()
+		if on_exit is not None:
+			on_exit(po)
+	#/def finished
+
+	def step(seq: list) -> None:
+		state["running"] += 1
+		run_thread(glob.ffmpeg_exe, seq[0], lambda po: done(po, seq[1:]))
+
+	def done(po, rest: list) -> None:				# a job slot was just freed
+		state["running"] -= 1
+		if po.returncode != 0:
+			state["failed"] = state["failed"] or po
+		elif rest:
+			step(rest)
+			return
+		if pending and state["failed"] is None:
+			step(pending.popleft())
+		elif state["running"] == 0:
+			if state["failed"] is not None:
+				finished(state["failed"])
+			elif concat is not None:
+				run_thread(glob.ffmpeg_exe, concat, finished)
+			else:
+				finished(po)
+	#/def done
+
+	for _ in range(max(1, min(len(pending), glob.max_threads - len(glob.proc_list)))):
+		step(pending.popleft())
+	return True
 # /def create_video_file
 
 
+def stream_init() -> None:
+	if not glob.stream or glob.dry_run:
+		return
+
+	arglist = ["-y", "-f", "image2pipe",
+				"-c:v", "png" if glob.img_format == "png" else "mjpeg"]
+	arglist.append("-framerate")
+	arglist.append(f"{glob.vid_fps}")
+	arglist.append("-i")
+	arglist.append("-")
+	arglist.extend(ff_output_args(glob.vid_frames, glob.out_file))
+	_DBG(term.values + str(arglist))
+
+	log_filename = os.path.join(glob.tmp_dir, os.path.basename(glob.out_file) + ".ffmpeg.log")
+	with open(log_filename, "w") as log:
+		glob.stream_proc = subprocess.Popen([glob.ffmpeg_exe] + arglist,
+											stdin = subprocess.PIPE,
+											stdout = subprocess.DEVNULL,
+											stderr = log)
+	glob.stream_proc.log_filename = log_filename
+	os.set_blocking(glob.stream_proc.stdin.fileno(), False)
+	glob.stream_ready = bytearray(glob.vid_frames)
+	glob.stream_next = 0
+	glob.stream_buf = None
+	_LOG(term.title + "Streaming to " + term.values + glob.ffmpeg_exe + term.title +
+		", log in " + term.values + log_filename + "\n")
+	return
+#/def stream_init
+
+
+# Frames whose files are complete, to be fed to ffmpeg and to interpolate between.
+def frames_ready(frames: list) -> None:
+	tmp_track(frames)
+	interp_frames_ready(frames)
+	stream_frames_ready(frames)
+	return
+#/def frames_ready
+
+
+# Count the numbered frames towards the bytes of frames waiting to be encoded.
+# Duplicate frames are hard links to the same file, counted once, and so is
+# the cache entry they are linked to.
+def tmp_track(frames: list) -> None:
+	for i in frames:
+		try:
+			st = os.stat(frame_filename(i))
+		except OSError:						# --dry-run
+			continue
+		entry = glob.tmp_inodes.get(st.st_ino)
+		if entry is None:
+			cached = None
+			if glob.cache_dir is not None:	# Interpolated frames aren't cached.
+				cached = cache_path(glob.plan.argv(i))
+				try:
+					if os.stat(cached).st_ino != st.st_ino:
+						cached = None
+				except OSError:
+					cached = None
+			entry = glob.tmp_inodes[st.st_ino] = [st.st_size, 0, cached]
+		if entry[1] == 0:
+			glob.tmp_bytes += entry[0]
+		entry[1] += 1
+	glob.tmp_peak = max(glob.tmp_peak, glob.tmp_bytes)
+	return
+#/def tmp_track
+
+
+# Delete a numbered frame that has been encoded. With --disk-budget, the cache
+# entry goes with the last frame linked to it, otherwise it stays on the disk
+# and counted.
+def tmp_delete(filename: str) -> None:
+	st = os.stat(filename)
+	os.remove(filename)
+	entry = glob.tmp_inodes.get(st.st_ino)
+	if entry is not None:
+		entry[1] -= 1
+		if entry[1] == 0:
+			if entry[2] is not None and glob.disk_budget_mb is not None:
+				if os.path.exists(entry[2]):
+					os.remove(entry[2])
+				entry[2] = None
+			if entry[2] is None:
+				glob.tmp_bytes -= entry[0]
+			del glob.tmp_inodes[st.st_ino]
+	return
+#/def tmp_delete
+
+
+# May another frame be rendered within --disk-budget? Frames that can't be
+# encoded yet, as an earlier one is missing, are what fills it. If nothing of
+# this job is running, one is admitted anyway, or the missing frame would never
+# be rendered.
+def disk_admit() -> bool:
+	if glob.disk_budget_mb is None or glob.tmp_bytes < glob.disk_budget_mb << 20:
+		return True
+	if not any(po.glob is glob for po in glob.proc_list):
+		return True
+	glob.disk_deferred += 1
+	return False
+#/def disk_admit
+
+
+def tmp_report() -> None:
+	if glob.tmp_peak == 0:
+		return
+	_LOG(term.title + "\nTmp: peak " + term.values + f"{glob.tmp_peak / (1 << 20):.1f}" +
+		term.title + " MB of frames waiting to be encoded" +
+		(", incl. their cache entries" if glob.cache_dir is not None else ""))
+	if glob.disk_deferred:
+		_LOG(term.title + ", " + term.values + f"{glob.disk_deferred}" + term.title +
+			" times a job was held back by --disk-budget")
+	_LOG(term.normal + "\n")
+	return
+#/def tmp_report
+
+
+def stream_frames_ready(frames: list) -> None:
+	if glob.stream_proc is None:
+		return
+	for i in frames:
+		glob.stream_ready[i] = 1
+	stream_feed()
+	return
+#/def stream_frames_ready
+
+
+# Write as much of the contiguous ready prefix to ffmpeg as the pipe takes
+# without blocking. If the pipe is full, wait for it in the scheduler's select().
+def stream_feed(mask: int = 0) -> None:
+	po = glob.stream_proc
+	fd = po.stdin.fileno()
+
+	while True:
+		if glob.stream_buf is None:
+			if (glob.stream_next >= glob.vid_frames or
+					not glob.stream_ready[glob.stream_next]):
+				break
+			fn = frame_filename(glob.stream_next)
+			with open(fn, "rb") as f:
+				glob.stream_buf = memoryview(f.read())
+			if glob.stream_delete:
+				tmp_delete(fn)
+			glob.stream_next += 1
+
+		try:
+			n = os.write(fd, glob.stream_buf)
+		except BlockingIOError:
+			n = 0
+		except BrokenPipeError:				# ffmpeg gave up, its returncode tells why.
+			glob.stream_buf = None
+			glob.stream_next = glob.vid_frames
+			break
+
+		glob.stream_buf = glob.stream_buf[n:] if n < len(glob.stream_buf) else None
+		if glob.stream_buf is not None:		# Pipe full.
+			if not glob.stream_wait:
+				glob.sched_sel.register(fd, selectors.EVENT_WRITE,
+					lambda mask, g = glob: glob_call(g, stream_feed, mask))
+				glob.stream_wait = True
+			return
+
+	if glob.stream_wait:
+		glob.sched_sel.unregister(fd)
+		glob.stream_wait = False
+	return
+#/def stream_feed
+
+
+# Feed what's left with blocking writes, then wait for ffmpeg. Returns True on error.
+def stream_finish(abort: bool = False) -> bool:
+	po = glob.stream_proc
+	if po is None:
+		return False
+
+	if abort:
+		po.kill()
+	else:
+		if glob.stream_wait:
+			glob.sched_sel.unregister(po.stdin.fileno())
+			glob.stream_wait = False
+		os.set_blocking(po.stdin.fileno(), True)
+		_LOG(term.title + "\nFinishing video file... ")
+		stream_feed()
+		if glob.stream_next < glob.vid_frames:
+			_LOG(term.err + "frame " + f"{glob.stream_next}" + " missing " + term.normal)
+	try:
+		po.stdin.close()
+	except BrokenPipeError:
+		pass
+	po.wait()
+	glob.stream_proc = None
+
+	if po.returncode != 0 and not abort:
+		with open(po.log_filename) as log:
+			_LOG(term.err + log.read()[-4096:] + term.normal + "\n")
+	return po.returncode != 0
+#/def stream_finish
+
+
+#***** Frame interpolation *****************************************************
+
+# Rotation in degrees between the poses of two frames, the shorter way round,
+# with 1% zoom counting as 1 degree. Infinite if pan or pivot change.
+def interp_motion(a: int, b: int) -> float:
+	pa = glob.plan.pose(a)
+	pb = glob.plan.pose(b)
+	if any(abs(pa[c] - pb[c]) > 1e-6 for c in POSE_COLS[4:]):
+		return math.inf
+	motion = 0.0
+	for c in ROT_COLS:
+		d = abs(pb[c] - pa[c]) % 360
+		motion = max(motion, min(d, 360 - d))
+	if pa["zoom"] > 0:
+		motion = max(motion, abs(pb["zoom"] / pa["zoom"] - 1) * 100)
+	return motion
+#/def interp_motion
+
+
+# With --interp N, every Nth frame and the last are key frames, rendered as
+# usual. The frames between two key frames are synthesized from them once both
+# are complete, unless the motion between them is too large or they share
+# their args with a frame that is rendered anyway.
+def interp_plan() -> None:
+	glob.interp_gaps, glob.interp_at, glob.interp_frames = [], {}, set()
+	glob.interp_q.clear()
+	glob.interp_started, glob.interp_finished = set(), set()
+	n = len(glob.plan)
+	if glob.interp <= 1 or n < 3:
+		return
+	glob.interp_ready = bytearray(n)
+
+	keys = list(range(0, n, glob.interp))
+	if keys[-1] != n - 1:
+		keys.append(n - 1)
+	real = set(keys)
+	gaps = []
+	for a, b in zip(keys, keys[1:]):
+		if b - a < 2:
+			continue
+		if interp_motion(a, b) > glob.interp_max:
+			real.update(range(a + 1, b))
+		else:
+			gaps.append((a, b))
+
+	real_groups = {glob.plan.group[i] for i in real}
+	for a, b in gaps:
+		between = [f for f in range(a + 1, b) if glob.plan.group[f] not in real_groups]
+		if not between:
+			continue
+		g = len(glob.interp_gaps)
+		glob.interp_gaps.append((a, b, between))
+		glob.interp_at.setdefault(a, []).append(g)
+		glob.interp_at.setdefault(b, []).append(g)
+		glob.interp_frames.update(between)
+		if glob.journal_done.issuperset(between) and not glob.stream_delete:
+			glob.interp_started.add(g)
+			glob.interp_finished.add(g)
+			frames_ready(between)
+			bench_update(len(between))
+
+	_LOG(term.title + "Interpolation: " + term.values + f"{len(glob.interp_frames)}" +
+		term.title + " of " + term.values + f"{n}" + term.title + " frames synthesized, " +
+		term.values + f"{len(real) - len(keys)}" + term.title + " rendered for motion\n")
+	return
+#/def interp_plan
+
+
+def interp_frames_ready(frames: list) -> None:
+	if not glob.interp_gaps:
+		return
+	for f in frames:
+		glob.interp_ready[f] = 1
+		for g in glob.interp_at.get(f, ()):
+			a, b, between = glob.interp_gaps[g]
+			if g not in glob.interp_started and glob.interp_ready[a] and glob.interp_ready[b]:
+				glob.interp_started.add(g)
+				glob.interp_q.append(g)
+	return
+#/def interp_frames_ready
+
+
+# Have ffmpeg synthesize the b - a - 1 frames between key frames a and b into a
+# directory of their own, from where interp_done() moves them into place.
+def interp_start(g: int) -> None:
+	a, b, between = glob.interp_gaps[g]
+	outdir = glob.img_base_name + f"INTERP_{a:06d}"
+	os.makedirs(outdir, exist_ok = True)
+	arglist = ["-y", "-framerate", "1", "-i", frame_filename(a),
+				"-framerate", "1", "-i", frame_filename(b),
+				"-filter_complex", "[0:v][1:v]concat=n=2:v=1[c];[c]minterpolate=fps=" +
+				f"{b - a}:mi_mode={glob.interp_mode}",
+				"-frames:v", f"{b - a}", "-start_number", "0",
+				os.path.join(outdir, "%06d" + glob.img_suffix)]
+	_LOG(term.title + "\nsynthesizing fr " + term.values + f"{a + 1}" + term.title + ".." +
+		term.values + f"{b - 1}" + term.title + " ")
+	_DBG(term.values + str(arglist))
+	run_thread(glob.ffmpeg_exe, arglist, lambda po: interp_done(po, g, outdir))
+	return
+#/def interp_start
+
+
+# Move the synthesized frames into place. If ffmpeg failed, render them instead.
+def interp_done(po: subprocess.Popen, g: int, outdir: str) -> None:
+	a, b, between = glob.interp_gaps[g]
+	glob.interp_finished.add(g)
+	files = {f: os.path.join(outdir, f"{f - a:06d}" + glob.img_suffix) for f in between}
+
+	if po.returncode == 0 and all(os.path.exists(fn) for fn in files.values()):
+		for f, fn in files.items():
+			os.replace(fn, frame_filename(f))
+		shutil.rmtree(outdir, ignore_errors = True)
+		journal_write("done", between)
+		frames_ready(between)
+		bench_update(len(between))
+		return
+
+	shutil.rmtree(outdir, ignore_errors = True)
+	_LOG(term.err + "\ninterpolation of fr " + f"{a + 1}" + ".." + f"{b - 1}" +
+		" failed, rendering them" + term.normal)
+	unique = {}
+	for f in between:
+		unique.setdefault(glob.plan.group[f], []).append(f)
+	for group, frames in unique.items():
+		args = glob.plan.group_argv(group)
+		if glob.cache_dir is not None:
+			final = cache_path(args)
+			glob.cache_used.add(final)
+		else:
+			final = frame_filename(frames[0])
+		job = FrameJob(group, frames, final + ".partial" + glob.img_suffix, final)
+		if not cache_wait(job):
+			glob.todo.append(job)
+	return
+#/def interp_done
+
+
+#***** Tiled rendering *********************************************************
+
+# kicad-cli args for tile k, counted row by row from the top left, of the frame
+# rendered with args: zoomed in tiles times and panned to the tile's centre.
+def tile_args(args: list, k: int) -> list:
+	n = glob.tiles
+	args = list(args)
+	opt = {args[i]: i + 1 for i in range(len(args) - 1) if args[i].startswith("--")}
+
+	zoom = float(args[opt["--zoom"]])
+	if "--pan" in opt:
+		pan = [float(v) for v in args[opt["--pan"]].strip("'").split(",")]
+	else:
+		pan = [0.0, 0.0, 0.0]
+		args[opt["--zoom"] + 1:opt["--zoom"] + 1] = ["--pan", ""]
+		opt = {args[i]: i + 1 for i in range(len(args) - 1) if args[i].startswith("--")}
+
+	col, row = k % n, k // n
+	pan[0] += ((col + 0.5) / n - 0.5) * glob.tile_span[0] / zoom
+	pan[1] -= ((row + 0.5) / n - 0.5) * glob.tile_span[1] / zoom
+	args[opt["--zoom"]] = f"{zoom * n:.3f}"
+	args[opt["--pan"]] = f"'{pan[0]:.4f},{pan[1]:.4f},{pan[2]:.4f}'"
+	args[opt["--width"]] = f"{glob.vid_dx // n}"
+	args[opt["--height"]] = f"{glob.vid_dy // n}"
+	return args
+#/def tile_args
+
+
+# Queue the tiles of a frame that aren't there from an earlier try or run. If
+# all are, stitch right away.
+def tile_expand(job: FrameJob) -> None:
+	job.tile_files = []
+	job.tiles_left = 0
+	job.tile_fail = None
+	job.tile_t0 = time.monotonic()
+	for k in range(glob.tiles * glob.tiles):
+		args = tile_args(glob.plan.group_argv(job.group), k)
+		if glob.cache_dir is not None:
+			path = cache_path(args)
+		else:
+			path = (glob.img_base_name + "TILE_" +
+					hashlib.sha256("\0".join(args).encode()).hexdigest()[:16] + glob.img_suffix)
+		job.tile_files.append(path)
+		if not os.path.exists(path) or (glob.overwrite and job.tries == 0):
+			glob.tile_q.append((job, k, args))
+			job.tiles_left += 1
+	if job.tiles_left == 0:
+		tile_stitch(job)
+	return
+#/def tile_expand
+
+
+def tile_start(job: FrameJob, k: int, args: list) -> None:
+	partial = job.tile_files[k] + ".partial" + glob.img_suffix
+	os.makedirs(os.path.dirname(partial) or ".", exist_ok = True)
+	run_render(args + ["--output", partial, glob.pcb_render],
+		lambda po: tile_done(po, job, k, partial), glob.frame_timeout)
+	return
+#/def tile_start
+
+
+# A tile has been rendered. Once all of the frame's are, stitch them, or fail
+# the frame if any failed.
+def tile_done(po, job: FrameJob, k: int, partial: str) -> None:
+	if po.returncode == 0:
+		os.replace(partial, job.tile_files[k])
+	else:
+		job.tile_fail = po
+		if os.path.exists(partial):
+			os.remove(partial)
+	if po.rusage is not None:				# The peak tile size is what sched_admit() needs.
+		glob.tel_rss_kb = max(glob.tel_rss_kb, po.rusage.ru_maxrss)
+
+	job.tiles_left -= 1
+	if job.tiles_left > 0:
+		return
+	if job.tile_fail is not None:
+		frame_done_local(job.tile_fail, job)
+	else:
+		tile_stitch(job)
+	return
+#/def tile_done
+
+
+def tile_stitch(job: FrameJob) -> None:
+	n = glob.tiles
+	tw, th = glob.vid_dx // n, glob.vid_dy // n
+	arglist = ["-y"]
+	for f in job.tile_files:
+		arglist.extend(["-i", f])
+	arglist.extend(["-filter_complex", f"xstack=inputs={n * n}:layout=" +
+					"|".join(f"{(k % n) * tw}_{(k // n) * th}" for k in range(n * n)),
+					"-frames:v", "1", "-update", "1", job.partial])
+	_DBG(term.values + str(arglist) + "\n")
+	run_thread(glob.ffmpeg_exe, arglist, lambda po: tile_stitched(po, job))
+	return
+#/def tile_stitch
+
+
+def tile_stitched(po: subprocess.Popen, job: FrameJob) -> None:
+	po.t_start = job.tile_t0				# The frame's cost is from its first tile on.
+	if po.returncode == 0 and glob.cache_dir is None:
+		for f in job.tile_files:
+			os.remove(f)
+	frame_done_local(po, job)
+	return
+#/def tile_stitched
+
+
+#***** Input staging ***********************************************************
+
+MODEL_RE = re.compile(r'\(model\s+("(?:[^"\\]|\\.)*"|[^\s()]+)')
+ENV_VAR_RE = re.compile(r'\$\{(\w+)\}|\$\((\w+)\)')
+
+
+# The 3D model library of a standard KiCad install: next to the kicad-cli used,
+# then the usual prefixes. None if there is none.
+def stage_model_dir() -> str:
+	prefixes = []
+	exe = shutil.which(glob.kicad_cli_exe or "")
+	if exe is not None:						# <prefix>/bin/kicad-cli, maybe a symlink
+		prefixes += [os.path.dirname(os.path.dirname(os.path.abspath(exe))),
+						os.path.dirname(os.path.dirname(os.path.realpath(exe)))]
+	prefixes += ["/usr", "/usr/local", "/opt/homebrew"]
+	candidates = [os.path.join(p, "share", d, "3dmodels") for p in prefixes
+					for d in ("kicad", "kicad-nightly")]
+	candidates.append("/Applications/KiCad/KiCad.app/Contents/SharedSupport/3dmodels")
+	program_files = os.environ.get("ProgramFiles")
+	if program_files is not None:			# C:\Program Files\KiCad\<version>\share\kicad\3dmodels
+		kicad = os.path.join(program_files, "KiCad")
+		try:
+			versions = sorted(os.listdir(kicad), reverse = True)
+		except OSError:
+			versions = []
+		candidates += [os.path.join(kicad, v, "share", "kicad", "3dmodels") for v in versions]
+	return next((d for d in candidates if os.path.isdir(d)), None)
+#/def stage_model_dir
+
+
+# Path variables for resolving 3D model paths: KIPRJMOD, those of the newest
+# KiCad configuration and the environment, which wins, and for the model
+# library variables set by neither, the standard install location.
+def stage_env() -> dict:
+	env = {}
+	cfg_root = os.path.join(os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config")),
+							"kicad")
+	try:
+		versions = sorted((d for d in os.listdir(cfg_root) if d[:1].isdigit()),
+							key = lambda d: [int(x) for x in d.split(".") if x.isdigit()])
+	except OSError:
+		versions = []
+	if versions:
+		try:
+			with open(os.path.join(cfg_root, versions[-1], "kicad_common.json")) as f:
+				env.update(json.load(f)["environment"]["vars"] or {})
+		except (OSError, ValueError, KeyError, TypeError):
+			pass
+	env.update(os.environ)
+	model_dir = stage_model_dir()
+	if model_dir is not None:
+		for var in ["KISYS3DMOD"] + [f"KICAD{n}_3DMODEL_DIR" for n in range(6, 11)]:
+			env.setdefault(var, model_dir)
+	env["KIPRJMOD"] = os.path.dirname(os.path.abspath(glob.pcb_file))
+	return env
+#/def stage_env
+
+
+# Copy src to dst, sharing the blocks if the filesystem can (FICLONE).
+def stage_copy(src: str, dst: str) -> None:
+	with open(src, "rb") as fs, open(dst, "wb") as fd:
+		try:
+			import fcntl
+			fcntl.ioctl(fd.fileno(), 0x40049409, fs.fileno())	# FICLONE
+			return
+		except (ImportError, OSError):
+			pass
+		shutil.copyfileobj(fs, fd, 1 << 20)
+	return
+#/def stage_copy
+
+
+# Copy the board and the 3D models it references to a directory under stage_dir,
+# typically on tmpfs, with the model paths rewritten to the copies, and render
+# from there. Models that can't be found are left to the renderer to resolve.
+def stage_inputs() -> None:
+	if glob.stage_dir is None or glob.dry_run:
+		return
+	if glob.coord_addr is not None:
+		_LOG(term.title + "Staging: " + term.values + "not with --coordinator\n")
+		return
+
+	with open(glob.pcb_file, encoding = "utf-8") as f:
+		text = f.read()
+	env = stage_env()
+	prj = env["KIPRJMOD"]
+
+	models = {}								# path as written -> resolved path
+	unresolved = 0
+	for m in MODEL_RE.finditer(text):
+		written = m.group(1)
+		if written in models:
+			continue
+		path = written[1:-1].replace('\\"', '"') if written.startswith('"') else written
+		path = ENV_VAR_RE.sub(lambda v: env.get(v.group(1) or v.group(2), v.group(0)), path)
+		path = os.path.join(prj, os.path.expanduser(path))
+		if os.path.isfile(path):
+			models[written] = path
+		else:
+			unresolved += 1
+
+	size = os.path.getsize(glob.pcb_file) + sum(os.path.getsize(p) for p in set(models.values()))
+	try:
+		os.makedirs(glob.stage_dir, exist_ok = True)
+		free = shutil.disk_usage(glob.stage_dir).free
+	except OSError as e:
+		_LOG(term.err + "Staging: " + str(e) + ", not staged\n" + term.normal)
+		return
+	if size > free // 2:					# Leave room for everything else.
+		_LOG(term.err + "Staging: " + f"{size >> 20}" + " MB needed, " + glob.stage_dir +
+			" has " + f"{free >> 20}" + " MB free, not staged\n" + term.normal)
+		return
+
+	glob.stage_path = os.path.join(glob.stage_dir, f"anim_pcb_stage_{os.getpid()}_{glob.batch_index}")
+	os.makedirs(os.path.join(glob.stage_path, "models"), exist_ok = True)
+	staged = {}								# resolved path -> copy
+	for i, src in enumerate(sorted(set(models.values()))):
+		staged[src] = os.path.join(glob.stage_path, "models", f"{i:04d}_" + os.path.basename(src))
+		stage_copy(src, staged[src])
+
+	def rewrite(m):
+		if m.group(1) not in models:
+			return m.group(0)
+		copy = staged[models[m.group(1)]].replace("\\", "\\\\").replace('"', '\\"')
+		return m.group(0)[:m.start(1) - m.start(0)] + '"' + copy + '"'
+	glob.pcb_render = os.path.join(glob.stage_path, os.path.basename(glob.pcb_file))
+	with open(glob.pcb_render, "w", encoding = "utf-8") as f:
+		f.write(MODEL_RE.sub(rewrite, text))
+	for ext in (".kicad_pro", ".kicad_prl"):	# Presets and colours come from the project.
+		src = os.path.splitext(glob.pcb_file)[0] + ext
+		if os.path.isfile(src):
+			stage_copy(src, os.path.splitext(glob.pcb_render)[0] + ext)
+
+	_LOG(term.title + "Staged: " + term.values + "board + " + f"{len(staged)}" + term.title +
+		" models, " + term.values + f"{size / (1 << 20):.1f}" + term.title + " MB in " +
+		term.values + glob.stage_path + term.title +
+		(", " + term.values + f"{unresolved}" + term.title + " models not found" if unresolved else "") +
+		"\n")
+	return
+#/def stage_inputs
+
+
+def stage_remove() -> None:
+	if glob.stage_path is not None:
+		shutil.rmtree(glob.stage_path, ignore_errors = True)
+		glob.stage_path = None
+		glob.pcb_render = glob.pcb_file
+	return
+#/def stage_remove
+
+
+#***** Distributed rendering ***************************************************
+
+def split_addr(addr: str) -> (str, int):
+	host, sep, port = addr.rpartition(":")
+	if not sep or not port.isdigit():
+		err_exit(term.err + "***ERROR*** address must be <host:port>: " + term.errdata +
+			addr + term.normal + "\n")
+	return (host or "0.0.0.0", int(port))
+#/def split_addr
+
+
+def coord_submit(args: list, partial: str, final: str, frames: list) -> None:
+	job = RemoteJob(len(glob.coord_jobs), args, partial, final, frames)
+	glob.coord_jobs.append(job)
+	glob.coord_pending.append(job)
+	return
+#/def coord_submit
+
+
+# Requests from workers. All share coord_lock, results are written to a
+# temporary file first and only the first result of a job is kept.
+#
+#	POST /job				-> 200 + JSON job, 204 if none right now, 410 when all are done
+#	POST /heartbeat			-> 200
+#	POST /result/<id>		X-Exit-Code: 0 and the image as body, or != 0 and error text
+#	GET  /pcb				-> the .kicad_pcb file
+class CoordHandler(http.server.BaseHTTPRequestHandler):
+	def log_message(self, fmt, *args):
+		_DBG(term.extra + "coordinator: " + (fmt % args) + "\n")
+
+	def reply(self, code: int, body: bytes = b"", ctype: str = "application/octet-stream"):
+		self.send_response(code)
+		self.send_header("Content-Type", ctype)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_GET(self):
+		if self.path != "/pcb":
+			return self.reply(404)
+		with open(glob.pcb_file, "rb") as f:
+			self.reply(200, f.read())
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		worker = self.headers.get("X-Worker", "?")
+		with glob.coord_lock:
+			if worker not in glob.coord_workers:
+				_LOG(term.title + "\nWorker " + term.values + worker + term.title + " joined ")
+			glob.coord_workers[worker] = time.monotonic()
+
+		if self.path == "/job":
+			with glob.coord_lock:
+				if not glob.coord_pending:
+					if (not glob.coord_closing or
+							any(j.state not in ("done", "failed") for j in glob.coord_jobs)):
+						return self.reply(204)
+					del glob.coord_workers[worker]	# Told to go home, no longer tracked.
+					return self.reply(410)
+				job = glob.coord_pending.popleft()
+				job.state, job.worker = "assigned", worker
+				job.tries += 1
+			return self.reply(200, json.dumps({"id": job.id, "args": job.args,
+				"suffix": glob.img_suffix, "pcb_hash": glob.pcb_hash}).encode(),
+				"application/json")
+
+		if self.path == "/heartbeat":
+			return self.reply(200)
+
+		if self.path.startswith("/result/"):
+			try:
+				job = glob.coord_jobs[int(self.path[len("/result/"):])]
+			except (ValueError, IndexError):
+				return self.reply(404)
+			ok = self.headers.get("X-Exit-Code") == "0"
+			if ok:
+				tmp = f"{job.partial}.{threading.get_ident()}{glob.img_suffix}"
+				with open(tmp, "wb") as f:
+					f.write(body)
+			with glob.coord_lock:
+				if job.state == "assigned" and job.worker == worker:
+					if ok:
+						job.state = "done"
+						os.replace(tmp, job.partial)
+						glob.coord_done.put(job)
+						tmp = None
+					else:
+						coord_retry(job, body.decode(errors = "replace"))
+			if ok and tmp is not None:		# Late result of a reassigned job.
+				os.remove(tmp)
+			return self.reply(200)
+
+		return self.reply(404)
+# /class CoordHandler
+
+
+# Requeue a job that failed or whose worker died, or give up on it. Called
+# with coord_lock held.
+def coord_retry(job: RemoteJob, why: str) -> None:
+	if job.tries > glob.retries:
+		job.state = "failed"
+		glob.coord_done.put(job)
+	else:
+		job.state, job.worker = "pending", None
+		glob.coord_pending.appendleft(job)
+	_LOG(term.err + "\nframe " + f"{job.frames[0]}" + ": " + why.strip() +
+		(", giving up" if job.state == "failed" else ", retrying") + term.normal)
+	return
+#/def coord_retry
+
+
+def coord_start() -> None:
+	if glob.coord_server is not None:
+		return
+	glob.coord_server = http.server.ThreadingHTTPServer(split_addr(glob.coord_addr), CoordHandler)
+	glob.coord_server.daemon_threads = True
+	threading.Thread(target = glob.coord_server.serve_forever, daemon = True).start()
+	_LOG(term.title + "\nCoordinator listening on " + term.values + glob.coord_addr + " ")
+	return
+#/def coord_start
+
+
+# Serve jobs to workers until every job submitted so far is done or failed.
+# Returns True if any failed.
+def coord_run() -> bool:
+	coord_start()
+	_LOG(term.title + "\nCoordinator: " + term.values +
+		f"{len(glob.coord_jobs) - glob.coord_finished}" + term.title + " jobs ")
+
+	ret = False
+	while glob.coord_finished < len(glob.coord_jobs):
+		try:
+			job = glob.coord_done.get(timeout = 1)
+		except queue.Empty:
+			job = None
+
+		if job is not None:
+			glob.coord_finished += 1
+			if job.state == "done":
+				frame_rendered(True, job.partial, job.final, job.frames)
+				bench_update(len(job.frames))
+				quarantine_release(job.args)
+			else:
+				frame_given_up(job.args, job.frames, job.final)
+				ret = True
+
+		now = time.monotonic()
+		with glob.coord_lock:
+			for worker, seen in list(glob.coord_workers.items()):
+				if now - seen > glob.worker_timeout:
+					del glob.coord_workers[worker]
+					_LOG(term.err + "\nWorker " + worker + " lost " + term.normal)
+					for j in glob.coord_jobs:
+						if j.state == "assigned" and j.worker == worker:
+							coord_retry(j, "worker " + worker + " lost")
+		progress_tick()
+	return ret
+#/def coord_run
+
+
+# Tell the workers we're done and stop serving.
+def coord_stop() -> None:
+	if glob.coord_server is None:
+		return
+	glob.coord_closing = True
+	deadline = time.monotonic() + glob.worker_timeout
+	while glob.coord_workers and time.monotonic() < deadline:
+		time.sleep(0.1)
+	glob.coord_server.shutdown()
+	glob.coord_server = None
+	return
+#/def coord_stop
+
+
+def worker_request(path: str, body: bytes = b"", headers: dict = {}) -> (int, bytes):
+	req = urllib.request.Request("http://" + glob.worker_addr + path, data = body,
+		headers = {"X-Worker": glob.worker_id, **headers},
+		method = "GET" if path == "/pcb" else "POST")
+	try:
+		with urllib.request.urlopen(req, timeout = glob.worker_timeout) as resp:
+			return (resp.status, resp.read())
+	except urllib.error.HTTPError as e:
+		return (e.code, b"")
+	except OSError:
+		return (None, b"")
+#/def worker_request
+
+
+def worker_result(po: subprocess.Popen, job: dict, out: str) -> None:
+	if po.returncode == 0:
+		with open(out, "rb") as f:
+			body = f.read()
+	else:
+		body = po.errtext.encode()
+	worker_request("/result/" + str(job["id"]), body, {"X-Exit-Code": str(po.returncode)})
+	if os.path.exists(out):
+		os.remove(out)
+	return
+#/def worker_result
+
+
+# Fetch and render jobs from the coordinator with up to max_threads local
+# processes, until it says all are done or can't be reached for worker_timeout.
+def worker_run() -> None:
+	glob.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+	heartbeat = glob.worker_timeout / 4
+	pcb_hash = pcb_local = None
+	finished = False
+	last_contact = last_heartbeat = time.monotonic()
+	rendered = 0
+
+	os.makedirs(glob.tmp_dir, exist_ok = True)
+	_LOG(term.title + "Worker " + term.values + glob.worker_id + term.title + " for " +
+		term.values + glob.worker_addr + term.title + ", " + term.values +
+		f"{glob.max_threads}" + term.title + " jobs\n")
+
+	while not finished or glob.proc_list:
+		while not finished and len(glob.proc_list) < glob.max_threads:
+			status, body = worker_request("/job")
+			if status is None:
+				if time.monotonic() - last_contact > glob.worker_timeout:
+					err_exit(term.err + "***ERROR*** coordinator unreachable\n" + term.normal)
+				break
+			last_contact = time.monotonic()
+			if status == 410:
+				finished = True
+			if status != 200:
+				break
+
+			job = json.loads(body)
+			if job["pcb_hash"] != pcb_hash:
+				status, pcb = worker_request("/pcb")
+				if status != 200:
+					err_exit(term.err + "***ERROR*** can't get .kicad_pcb\n" + term.normal)
+				pcb_hash = job["pcb_hash"]
+				pcb_local = os.path.join(glob.tmp_dir, f"worker_{pcb_hash[:16]}.kicad_pcb")
+				with open(pcb_local, "wb") as f:
+					f.write(pcb)
+
+			out = os.path.join(glob.tmp_dir,
+				f"worker_{os.getpid()}_{job['id']:06d}{job['suffix']}")
+			_DBG(term.values + str(job["args"]) + "\n")
+			run_render(job["args"] + ["--output", out, pcb_local],
+				lambda po, job = job, out = out: worker_result(po, job, out), glob.frame_timeout)
+			rendered += 1
+
+		sched_wait(heartbeat)
+		if time.monotonic() - last_heartbeat >= heartbeat and glob.proc_list:
+			worker_request("/heartbeat")
+			last_heartbeat = time.monotonic()
+
+	server_stop_all()
+	if pcb_local is not None:
+		os.remove(pcb_local)
+	_LOG(term.title + "Worker done, " + term.values + f"{rendered}" + term.title +
+		" frames rendered\n")
+	return
+#/def worker_run
+
+
+#***** Stand-in renderer *******************************************************
+
+# Minimal truecolour PNG of a single colour.
+def png_bytes(dx: int, dy: int, rgb: bytes) -> bytes:
+	def chunk(typ: bytes, data: bytes) -> bytes:
+		return (struct.pack(">I", len(data)) + typ + data +
+				struct.pack(">I", zlib.crc32(typ + data)))
+	raw = (b"\0" + rgb * dx) * dy
+	return (b"\x89PNG\r\n\x1a\n" +
+			chunk(b"IHDR", struct.pack(">IIBBBBB", dx, dy, 8, 2, 0, 0, 0)) +
+			chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+#/def png_bytes
+
+
+# Behaves like "kicad-cli pcb render" for testing without KiCad: writes a PNG
+# of the requested size, coloured by a hash of the pose args, after sleeping
+# $ANIM_PCB_STAND_IN_SEC (default 0.2) seconds. Loading the board takes
+# $ANIM_PCB_STAND_IN_LOAD (default 0) seconds, once per board in loaded if given.
+def stand_in_render(argv: list, loaded: set = None) -> None:
+	if "--version" in argv:
+		print("stand-in")
+		return
+	opt = {argv[i]: argv[i + 1] for i in range(len(argv) - 1) if argv[i].startswith("--")}
+	if loaded is None or argv[-1] not in loaded:
+		time.sleep(float(os.environ.get("ANIM_PCB_STAND_IN_LOAD", "0")))
+		if loaded is not None:
+			loaded.add(argv[-1])
+	time.sleep(float(os.environ.get("ANIM_PCB_STAND_IN_SEC", "0.2")))
+	rgb = hashlib.sha256(" ".join(argv[:argv.index("--output")]).encode()).digest()[:3]
+	with open(opt["--output"], "wb") as f:
+		f.write(png_bytes(int(opt.get("--width", 64)), int(opt.get("--height", 64)), rgb))
+	return
+#/def stand_in_render
+
+
+# The stand-in as a renderer server for --backend server, see --server-cmd.
+def stand_in_serve() -> None:
+	loaded = set()
+	for line in sys.stdin:
+		try:
+			stand_in_render(json.loads(line), loaded)
+			reply = {"ok": True}
+		except Exception as e:
+			reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+		sys.stdout.write(json.dumps(reply) + "\n")
+		sys.stdout.flush()
+	return
+#/def stand_in_serve
+
+
+#***** Telemetry ***************************************************************
+
+TEL_FIELDS = ("pass", "frame", "dups", "queue_s", "wall_s", "user_s", "sys_s", "rss_kb",
+				"size", "exit") + POSE_COLS
+
+
+def telemetry_open() -> None:
+	glob.tel_start = time.monotonic()
+	if glob.telemetry is None or glob.dry_run:
+		return
+	glob.tel_out = open(glob.telemetry, "w", newline = "")
+	if glob.telemetry.endswith(".csv"):
+		glob.tel_csv = csv.writer(glob.tel_out)
+		glob.tel_csv.writerow(TEL_FIELDS)
+	return
+#/def telemetry_open
+
+
+# Record one finished kicad-cli process. Resource use is from os.wait4(),
+# queue wait is from the start of the pass until the process was started.
+def telemetry_record(po: subprocess.Popen, final: str, frames: list) -> None:
+	wall = po.t_end - po.t_start
+	ru = po.rusage
+	user, sys_, rss = (ru.ru_utime, ru.ru_stime, ru.ru_maxrss) if ru is not None else (0, 0, 0)
+	pose = glob.plan.table.pose(glob.plan.rows[frames[0]])
+
+	glob.tel_wall.append(wall)
+	glob.tel_cpu_sec += user + sys_
+	glob.tel_rss_kb = max(glob.tel_rss_kb, rss)
+	entry = (wall, frames[0], pose)
+	if len(glob.tel_slowest) < 5:
+		heapq.heappush(glob.tel_slowest, entry)
+	else:
+		heapq.heappushpop(glob.tel_slowest, entry)
+
+	if glob.tel_out is None:
+		return
+	rec = (os.path.basename(glob.img_base_name), frames[0], len(frames) - 1,
+			round(po.t_start - glob.start_sec, 4), round(wall, 4), round(user, 4),
+			round(sys_, 4), rss, os.path.getsize(final) if po.returncode == 0 else 0,
+			po.returncode) + tuple(round(v, 4) for v in pose)
+	if glob.tel_csv is not None:
+		glob.tel_csv.writerow(rec)
+	else:
+		glob.tel_out.write(json.dumps(dict(zip(TEL_FIELDS, rec))) + "\n")
+	return
+#/def telemetry_record
+
+
+def telemetry_close() -> None:
+	if glob.tel_out is not None:
+		glob.tel_out.close()
+		glob.tel_out = None
+		glob.tel_csv = None
+	return
+#/def telemetry_close
+
+
+def telemetry_report() -> None:
+	n = len(glob.tel_wall)
+	if n == 0:
+		return
+
+	walls = sorted(glob.tel_wall)
+	elapsed = time.monotonic() - glob.tel_start
+	util = glob.tel_cpu_sec / (elapsed * cpus_available()) if elapsed > 0 else 0
+	_LOG(term.title + "Frames: " + term.values + f"{n}" + term.title + " rendered, p50 " +
+		term.values + f"{walls[n // 2]:.2f}" + term.title + "s, p95 " + term.values +
+		f"{walls[min(n - 1, (n * 95) // 100)]:.2f}" + term.title + "s, max RSS " + term.values +
+		f"{glob.tel_rss_kb // 1024}" + term.title + " MB, core utilization " + term.values +
+		f"{util * 100:.0f}" + term.title + "%\n")
+	for wall, frame, pose in sorted(glob.tel_slowest, reverse = True):
+		_LOG(term.title + "    slow " + term.values + f"{wall:8.2f}" + term.title + "s fr " +
+			term.values + f"{frame:6d}" + term.title + " z " + term.values + f"{pose[0]:.3f}" +
+			term.title + " rot " + term.values + f"({pose[1]:.1f}, {pose[2]:.1f}, {pose[3]:.1f})\n")
+	return
+#/def telemetry_report
+
+
 def bench_init() -> None:
 	glob.elapsed_sec = 0
-	glob.remain_sec = 0
+	glob.remain_sec = None
 	glob.start_sec = time.monotonic()
+	glob.frames_done = 0
 	glob.frames_left = glob.vid_frames
+	glob.cost_idx, glob.cost_sec = [], []
+	glob.eta_at = 0
+	glob.progress_at = 0
 	return
 #/def bench_init
 
 
+# frames_done frames have been completed, by rendering or otherwise.
 def bench_update(frames_done:int = 1) -> None:
 	glob.current_sec = time.monotonic()
 	glob.elapsed_sec = glob.current_sec - glob.start_sec
@@ -709,48 +3773,663 @@ def bench_update(frames_done:int = 1) -> None:
 	if glob.frames_done != 0:
 		glob.sec_per_frame = glob.elapsed_sec / float(glob.frames_done)
 
-	glob.remain_sec = glob.sec_per_frame * glob.frames_left
+	if glob.current_sec - glob.eta_at >= glob.eta_every:
+		bench_eta()
 	return
 
 
+def cost_record(frame: int, sec: float) -> None:
+	i = bisect.bisect_left(glob.cost_idx, frame)
+	glob.cost_idx.insert(i, frame)
+	glob.cost_sec.insert(i, sec)
+	return
+#/def cost_record
+
+
+# Predicted render time of a frame, interpolated between the nearest completed
+# frames before and after it, which have similar poses. None if nothing is known.
+def cost_predict(frame: int) -> float:
+	idx, sec = glob.cost_idx, glob.cost_sec
+	i = bisect.bisect_left(idx, frame)
+	if i < len(idx) and idx[i] == frame:
+		return sec[i]
+	if 0 < i < len(idx):
+		f = (frame - idx[i - 1]) / (idx[i] - idx[i - 1])
+		return sec[i - 1] * (1 - f) + sec[i] * f
+	if i > 0:
+		return sec[i - 1]
+	if idx:
+		return sec[0]
+	return None
+#/def cost_predict
+
+
+# Remaining time: predicted cost of the frames not started plus what's left of
+# the running ones, spread over max_threads. The cost of computing it is kept
+# below 5% by spacing the computations out.
+def bench_eta() -> None:
+	t0 = time.monotonic()
+	if not glob.cost_idx:
+		glob.remain_sec = None
+		return
+
+	total = sum(cost_predict(job.frames[0]) for job in glob.todo)
+	for po in glob.proc_list:
+		if po.job is not None and po.glob is glob:
+			total += max(0, cost_predict(po.job.frames[0]) - (t0 - po.t_start))
+	glob.remain_sec = total / glob.max_threads
+
+	glob.eta_at = time.monotonic()
+	glob.eta_every = max(1, 20 * (glob.eta_at - t0))
+	return
+#/def bench_eta
+
+
 def bench_get_min_sec() -> (int, int):
 	return divmod(int(glob.remain_sec), 60)
 
 
-#***** Main ********************************************************************
+def bench_report_sched() -> None:
+	if glob.sched_jobs == 0:
+		return
+	_LOG(term.title + "Scheduler overhead: " + term.values +
+		f"{glob.sched_cpu_sec * 1000 / glob.sched_jobs:.3f}" + term.title + " ms CPU/job (" +
+		term.values + f"{glob.sched_cpu_sec:.3f}" + term.title + "s for " + term.values +
+		f"{glob.sched_jobs}" + term.title + " jobs)\n" + term.normal)
+	if glob.mem_deferred:
+		_LOG(term.title + "Memory: " + term.values + f"{glob.mem_deferred}" + term.title +
+			" times a job was held back for lack of memory\n" + term.normal)
+	return
 
-glob = Globals()
 
-# I can't be bothered to find out which Python version is needed, so 3.7 is
-# arbitrarily chosen.
-if sys.hexversion < 0x03070000:		# bits 31..24: major, bits 23..16: minor
-	err_exit(term.err + "***ERROR*** Python 3.7 or higher required. \n")
+# Frames spread over the video for benchmarks, as kicad-cli args, and the
+# directory to render them to.
+def bench_sample(n: int) -> (list, str):
+	m = len(glob.plan.keys)
+	n = max(1, min(n, m))
+	sample = [glob.plan.group_argv((i * m) // n) for i in range(n)]
+
+	bench_dir = os.path.join(glob.tmp_dir, "anim_pcb_bench")
+	if not glob.dry_run:
+		os.makedirs(bench_dir, exist_ok = True)
+	return sample, bench_dir
+#/def bench_sample
+
+
+# Render the sample with up to max_threads jobs. Returns the elapsed time and the
+# time each frame took.
+def bench_render(sample: list, bench_dir: str) -> (float, list):
+	walls = []
+	def done(po):
+		walls.append(po.t_end - po.t_start)
+		if po.returncode != 0:
+			err_exit(term.err + "***ERROR*** " + glob.kicad_cli_exe +
+				" call returned error\n" + term.normal)
+
+	t0 = time.monotonic()
+	for i, args in enumerate(sample):
+		wait_available_thread_slots(1)
+		arglist = args + ["--output",
+			os.path.join(bench_dir, f"bench_{i:06d}{glob.img_suffix}"), glob.pcb_render]
+		if not glob.dry_run:
+			run_render(arglist, done)
+	wait_available_thread_slots(glob.max_threads)
+	return time.monotonic() - t0, walls
+#/def bench_render
+
+
+# Render the same sample of frames once per --bench-jobs value, bypassing the
+# cache, and report frames/s for each.
+def bench_jobs() -> None:
+	sample, bench_dir = bench_sample(glob.bench_frames or 2 * max(glob.bench_jobs))
+	n = len(sample)
+
+	_LOG(term.title + "Benchmark: " + term.values + f"{n}" + term.title + " frames per run, " +
+		term.values + f"{cpus_available()}" + term.title + " CPUs available\n")
+
+	results = []
+	for jobs in glob.bench_jobs:
+		glob.max_threads = jobs
+		dt, walls = bench_render(sample, bench_dir)
+		server_stop_all()					# The next -j gets fresh servers.
+		results.append((n / dt if dt > 0 else 0, jobs))
+		_LOG(term.title + "    -j " + term.values + f"{jobs:3d}" + term.title + ": " +
+			term.values + f"{dt:8.2f}" + term.title + "s " + term.values +
+			f"{results[-1][0]:8.3f}" + term.title + " frames/s\n")
+
+	if not glob.dry_run:
+		shutil.rmtree(bench_dir)
+	best_fps, best_jobs = max(results)
+	_LOG(term.title + "Best: " + term.values + f"-j {best_jobs}" + term.title + " (" +
+		term.values + f"{best_fps:.3f}" + term.title + " frames/s)\n" + term.normal)
+	return
+#/def bench_jobs
+
+
+# Render the same sample with each backend and compare the time per frame. A
+# server is started and its first frame rendered before timing, so what the
+# difference shows is the startup and board load cost paid per frame by exec.
+def bench_backends() -> None:
+	sample, bench_dir = bench_sample(glob.bench_frames or 4 * glob.max_threads)
+	n = len(sample)
+	backends = ["exec"] + (["server"] if glob.server_cmd is not None else [])
+
+	_LOG(term.title + "Benchmark: " + term.values + f"{n}" + term.title + " frames per backend, -j " +
+		term.values + f"{glob.max_threads}" + "\n")
+	if glob.server_cmd is None:
+		_LOG(term.title + "    no --server-cmd, server backend not benchmarked\n")
+
+	per_frame = {}
+	for backend in backends:
+		glob.backend = backend
+		if backend == "server":				# Warm up one server per job slot.
+			bench_render(sample[:1] * glob.max_threads, bench_dir)
+		dt, walls = bench_render(sample, bench_dir)
+		server_stop_all()
+		per_frame[backend] = sum(walls) / len(walls) if walls else 0
+		_LOG(term.title + "    " + term.values + f"{backend:6s}" + term.title + ": " +
+			term.values + f"{dt:8.2f}" + term.title + "s " + term.values +
+			f"{n / dt if dt > 0 else 0:8.3f}" + term.title + " frames/s " + term.values +
+			f"{per_frame[backend]:8.3f}" + term.title + " s/frame\n")
+
+	if not glob.dry_run:
+		shutil.rmtree(bench_dir)
+	if len(per_frame) == 2:
+		_LOG(term.title + "Startup cost per frame: " + term.values +
+			f"{per_frame['exec'] - per_frame['server']:.3f}" + term.title + "s\n" + term.normal)
+	return
+#/def bench_backends
+
+
+# Plan, render and encode the video. With a name, this is a preview pass at
+# 1/preview_scale resolution and basic quality, with frames and video named
+# after it, rendering only every Nth frame.
+def render_pass(frame_name: str = None, video_name: str = None, every: int = 1) -> None:
+	saved = (glob.vid_dx, glob.vid_dy, glob.vid_fps, glob.vid_frames, glob.kc_quality,
+				glob.img_base_name, glob.out_file)
+
+	if frame_name is not None:
+		_LOG(term.title + "\nPreview pass " + term.values + video_name + "\n")
+		glob.vid_dx = max(1, glob.vid_dx // glob.preview_scale)
+		glob.vid_dy = max(1, glob.vid_dy // glob.preview_scale)
+		glob.kc_quality = "basic"
+		glob.img_base_name = glob.img_base_name[:-len(".FRAME_")] + frame_name
+		if glob.out_file is not None:
+			root, ext = os.path.splitext(glob.out_file)
+			glob.out_file = root + video_name + ext
+
+	glob.plan = plan_frames(every)
+	glob.vid_frames = len(glob.plan)
+	glob.vid_fps = max(1, round(glob.vid_fps / every))
+
+	bench_init()
+	journal_open()
+	stream_init()
+
+	if render_frames():
+		stream_finish(abort = True)
+		err_exit(term.err + "***ERROR*** " + f"{len(glob.failed_frames)}" + " frames failed, " +
+				glob.kicad_cli_exe + " calls returned an error\n" + term.normal)
+
+	journal_close()
+	create_video_file()
+
+	if wait_available_thread_slots(glob.max_threads) or stream_finish():
+		err_exit(term.err + "***ERROR*** " + glob.ffmpeg_exe +
+				" call returned error\n" + term.normal)
+	tmp_report()
+
+	(glob.vid_dx, glob.vid_dy, glob.vid_fps, glob.vid_frames, glob.kc_quality,
+		glob.img_base_name, glob.out_file) = saved
+	return
+#/def render_pass
+
+
+#***** Batch mode **************************************************************
+
+# Command line of a table of long options without the leading "--", with a list
+# for options given more than once and true for flags.
+def opts_argv(opts) -> list:
+	if not isinstance(opts, dict):
+		err_exit(term.err + "***ERROR*** job is not a table of options: " + term.errdata +
+			str(opts) + term.normal + "\n")
+	argv = []
+	for key, val in opts.items():
+		opt = ("-" if len(key) == 1 else "--") + key
+		for v in (val if isinstance(val, list) else [val]):
+			if v is True:
+				argv.append(opt)
+			elif v is not False and v is not None:
+				argv.extend([opt, str(v)])
+	return argv
+#/def opts_argv
+
+
+# Command lines of the jobs in the --batch job file: the command line without
+# --batch, then the defaults, then the options of the job.
+def batch_load() -> list:
+	try:
+		if glob.batch_file.endswith(".toml"):
+			import tomllib					# Python >= 3.11
+			with open(glob.batch_file, "rb") as f:
+				doc = tomllib.load(f)
+		elif glob.batch_file.endswith((".yaml", ".yml")):
+			import yaml						# PyYAML, if installed
+			with open(glob.batch_file) as f:
+				doc = yaml.safe_load(f)
+		else:
+			with open(glob.batch_file) as f:
+				doc = json.load(f)
+	except ImportError as e:
+		err_exit(term.err + "***ERROR*** cannot read " + term.errdata + glob.batch_file +
+			term.err + ": " + str(e) + term.normal + "\n")
+	except (OSError, ValueError) as e:
+		err_exit(term.err + "***ERROR*** job file " + term.errdata + glob.batch_file +
+			term.err + ": " + str(e) + term.normal + "\n")
+
+	if isinstance(doc, list):
+		doc = {"jobs": doc}
+	if not isinstance(doc, dict) or not isinstance(doc.get("jobs"), list) or not doc["jobs"]:
+		err_exit(term.err + "***ERROR*** job file has no list of jobs: " + term.errdata +
+			glob.batch_file + term.normal + "\n")
+
+	base, skip = [], False
+	for a in glob.argv:
+		if skip or a == "--batch" or a.startswith("--batch="):
+			skip = a == "--batch"
+			continue
+		base.append(a)
+	base += opts_argv(doc.get("defaults", {}))
+	return [base + opts_argv(job) for job in doc["jobs"]]
+#/def batch_load
+
+
+def batch_running(g: Globals) -> int:
+	return sum(1 for po in glob.proc_list if po.glob is g)
+
+
+# Set up a job: plan and triage its frames, start streaming if asked to.
+def batch_job_start() -> None:
+	glob.plan = plan_frames()
+	glob.vid_frames = len(glob.plan)
+	bench_init()
+	journal_open()
+	stream_init()
+	render_begin()
+	glob.batch_state = "render"
+	return
+#/def batch_job_start
+
+
+# All frames of the job are done: encode the video, without waiting for ffmpeg
+# unless streaming.
+def batch_job_end() -> None:
+	failed = render_end()
+	journal_close()
+	_LOG(term.title + "\nJob " + term.values + f"{glob.batch_index}" + term.title + " " +
+		term.values + glob.pcb_file + term.title + ": ")
+
+	if failed:
+		_LOG(term.err + f"{len(glob.failed_frames)}" + " frames failed, no video\n" + term.normal)
+		stream_finish(abort = True)
+		batch_job_done(False)
+	elif glob.stream:
+		batch_job_done(not stream_finish())
+	else:
+		if not create_video_file(lambda po: batch_job_done(po.returncode == 0)):
+			batch_job_done(True)
+		else:
+			glob.batch_state = "encode"
+	return
+#/def batch_job_end
+
 
+def batch_job_done(ok: bool) -> None:
+	glob.batch_state = "done"
+	glob.batch_failed = not ok
+	if ok:
+		_LOG(term.title + "\nJob " + term.values + f"{glob.batch_index}" + term.title + " done\n")
+	else:
+		_LOG(term.err + "\nJob " + f"{glob.batch_index}" + " " + glob.pcb_file + " failed\n" +
+			term.normal)
+	telemetry_report()
+	tmp_report()
+	return
+#/def batch_job_done
+
+
+# Render the jobs of the job file from one queue. Whenever a job slot is free,
+# the job that has been given the fewest frames relative to its priority gets
+# it, and a job whose frames are done is encoded while the others go on rendering.
+def batch_run() -> None:
+	top = glob
+	jobs = []
+	base_names = set()
+	quarantines = {}
+	telemetry_open()						# One file for all jobs, see telemetry_record().
+	try:
+		for n, argv in enumerate(batch_load()):
+			glob_switch(Globals())
+			glob.debug_mode = top.debug_mode
+			glob.log_fn = top.log_fn
+			_DBG(term.values + "Job " + f"{n}" + ": " + str(argv) + "\n")
+			parse_cmdline(argv)
+			if (glob.preview_every or glob.coord_addr or glob.worker_addr or glob.bench_jobs or
+					glob.bench_backends or glob.dump_frames or glob.save_plan or glob.batch_file):
+				err_exit(term.err + "***ERROR*** job " + f"{n}" + ": --preview, --coordinator, " +
+					"--worker, --bench-jobs, --bench-backends, --dump-frames, --save-plan and " +
+					"--batch can't be used in a job\n" + term.normal)
+			if glob.telemetry != top.telemetry:
+				err_exit(term.err + "***ERROR*** job " + f"{n}" + ": --telemetry can only be " +
+					"given on the command line\n" + term.normal)
+			check_existance_infile()
+			segments_from_args()
+
+			glob.batch_index = n
+			for attr in ("sched_sel", "sched_sigfd", "proc_list", "max_threads", "core_sets",
+							"core_use", "servers", "tel_out", "tel_csv", "tel_start",
+							"cache_inflight"):
+				setattr(glob, attr, getattr(top, attr))
+			if glob.img_base_name in base_names:		# Same board in the same tmpdir.
+				glob.img_base_name = glob.img_base_name[:-len("FRAME_")] + f"{n}.FRAME_"
+			base_names.add(glob.img_base_name)
+
+			cache_init()
+			stage_inputs()
+			if glob.tmp_dir not in quarantines:
+				quarantine_load()
+				quarantines[glob.tmp_dir] = (glob.quarantine, glob.quarantine_run)
+			glob.quarantine, glob.quarantine_run = quarantines[glob.tmp_dir]
+			jobs.append(glob)
+	finally:
+		glob_switch(top)
+
+	for g in jobs:
+		glob_call(g, batch_job_start)
+	_LOG(term.title + "\nBatch: " + term.values + f"{len(jobs)}" + term.title + " jobs, " +
+		term.values + f"{sum(g.vid_frames for g in jobs)}" + term.title + " frames\n")
+
+	while any(g.batch_state != "done" for g in jobs):
+		if len(glob.proc_list) < glob.max_threads:
+			for g in jobs:
+				if (g.batch_state == "render" and not g.todo and not g.retry_q and
+						not g.tile_q and not g.interp_q and not g.cache_waiting and
+						batch_running(g) == 0 and
+						len(glob.proc_list) < glob.max_threads):
+					glob_call(g, batch_job_end)
+
+			now = time.monotonic()
+			ready = [g for g in jobs if g.batch_state == "render" and
+						(g.todo or g.tile_q or g.interp_q or
+						(g.retry_q and g.retry_q[0][0] <= now)) and glob_call(g, disk_admit)]
+			if ready and sched_admit():
+				g = min(ready, key = lambda g: (g.batch_started + 1) / g.priority)
+				glob_call(g, render_dispatch)
+				g.batch_started += 1
+				continue
+
+		if not glob.proc_list and not any(g.retry_q for g in jobs if g.batch_state == "render"):
+			continue						# Only jobs ready to end, see above.
+		retry_at = [g.retry_q[0][0] for g in jobs if g.batch_state == "render" and g.retry_q]
+		render_wait(min(retry_at) if retry_at else None)
+
+	server_stop_all()
+	used = set().union(*(g.cache_used for g in jobs))
+	for g in jobs:
+		g.cache_used = used
+		glob_call(g, cache_evict)
+		glob_call(g, stage_remove)
+		glob.sched_cpu_sec += g.sched_cpu_sec
+		glob.sched_jobs += g.sched_jobs
+		glob.mem_deferred += g.mem_deferred
+	telemetry_close()
+	bench_report_sched()
+
+	failed = [g for g in jobs if g.batch_failed]
+	if failed:
+		err_exit(term.err + "\n***ERROR*** " + f"{len(failed)}" + " of " + f"{len(jobs)}" +
+			" jobs failed: " + ", ".join(g.pcb_file for g in failed) + term.normal)
+	_LOG(term.title + "\nDone.\n")
+	return
+#/def batch_run
 
-parse_cmdline()				# Returns IFF cmdline args seem mostly ok.
 
-check_existance_infile()	# Returns IFF infile exists.
+#***** Library API *************************************************************
 
-segments_from_args()		# Returns IFF all --segment specs check out syntactically ok.
+# Everything the command line does after parse_cmdline(), for the current
+# Globals. Servers, the coordinator, staged files and the scheduler are cleaned
+# up also when it raises AnimPcbError.
+def render_main() -> None:
+	try:
+		render_all()
+	except BaseException:
+		stream_finish(abort = True)
+		raise
+	finally:
+		coord_stop()
+		server_stop_all()
+		stage_remove()
+		telemetry_close()
+		sched_close()
+	return
+#/def render_main
 
-_DBG(term.title + "\nGLOBALS " + term.extra + glob.__repr__() + '\n' + term.normal)
 
-bench_init()
-render_frames()
+def render_all() -> None:
+	if glob.worker_addr is not None:
+		sched_init()
+		worker_run()
+		return
 
-if wait_available_thread_slots(glob.max_threads):
-	err_exit(term.err + "***ERROR*** at least one of the " + glob.kicad_cli_exe +
-			" calls returned an error\n" + term.normal)
+	if glob.batch_file is not None:
+		sched_init()
+		if glob.pin_cores:
+			core_sets_init()
+		batch_run()
+		return
 
-create_video_file()
+	check_existance_infile()	# Returns IFF infile exists.
 
-if wait_available_thread_slots(glob.max_threads):
-	err_exit(term.err + "***ERROR*** " + glob.ffmpeg_exe +
-			" call returned error\n" + term.normal)
+	segments_from_args()		# Returns IFF all --segment specs check out syntactically ok.
 
+	_DBG(term.title + "\nGLOBALS " + term.extra + glob.__repr__() + '\n' + term.normal)
+
+	if glob.dump_frames is not None:
+		dump_frame_table(plan_frames().table, glob.dump_frames)
+		return
+
+	if glob.save_plan is not None:
+		plan_save(plan_frames(), glob.save_plan)
+		_LOG(term.title + "Plan written to " + term.values + glob.save_plan + "\n" + term.normal)
+		return
+
+	sched_init()
+	if glob.pin_cores:
+		core_sets_init()
+	_LOG(term.title + "Jobs: " + term.values + f"{glob.max_threads}" + term.title + " x " +
+		term.values + f"{glob.threads_per_job}" + term.title + " CPUs" +
+		(" pinned\n" if glob.pin_cores else "\n"))
+
+	if glob.bench_jobs is not None or glob.bench_backends:
+		glob.plan = plan_frames()
+		stage_inputs()
+		if glob.bench_jobs is not None:
+			bench_jobs()
+		else:
+			bench_backends()
+		return
+
+	cache_init()
+	quarantine_load()
+	stage_inputs()
+	telemetry_open()
+
+	if glob.preview_every > 0:
+		render_pass(".PREVIEW1_", ".preview1", glob.preview_every)
+		render_pass(".PREVIEW_", ".preview")
+	if not glob.preview_only:
+		render_pass()
+	coord_stop()
+	server_stop_all()
+	stage_remove()
+
+	cache_evict()
+	telemetry_close()
+	telemetry_report()
+	bench_report_sched()
+	_LOG(term.title + "\nDone.\n")
+	return
+#/def render_all
+
+
+# Output of the library API, by default: complete lines to the "anim_pcb"
+# logger at INFO level. Colours are left out.
+class LogLines:
+	def __init__(self, logger: logging.Logger = None):
+		self.logger = logger or logging.getLogger("anim_pcb")
+		self.buf = ""
+
+	def __call__(self, txt: str) -> None:
+		lines = (self.buf + txt.replace("\r", "\n")).split("\n")
+		self.buf = lines.pop()
+		for line in lines:
+			if line.strip():
+				self.logger.info("%s", line)
+		return
+# /class LogLines
+
+
+# Parse --segment expressions, e.g. ["1s rot(0,0,0) -> rot(0,0,90)"], into
+# SegmentSpecs for fps frames per second. Raises AnimPcbError on syntax errors.
+# Output goes to log, see Renderer.
+def parse_segments(segment_args: list, fps: int = 30, log = None) -> list:
+	g = Globals(vid_fps = fps, vid_fpms = fps / 1000, segment_args = list(segment_args),
+				log_fn = log or LogLines(), nocolor = log is None)
+	with _api_lock:
+		glob_call(g, segments_from_args)
+	return g.segments
+#/def parse_segments
+
+
+# Renders, and all other command line functions, can only run one at a time in
+# a process, as the current Globals is module wide. See Renderer.run_async().
+_api_lock = threading.RLock()
+
+
+# A render as the command line would do it, to be run any number of times from
+# one process. options are the command line arguments, as a list or as a table
+# of long options like a --batch job, e.g.
+#	Renderer({"in": "board.kicad_pcb", "res": "640x480", "out": "board.mp4",
+#				"segment": ["2s rot(0,0,0) -> rot(0,0,360)"]})
+# Bad options raise AnimPcbError. The backend (exec or server, see --backend and
+# --server-cmd) is chosen with the options as well. All output is passed to log,
+# a callable taking each piece of text as it would be printed, coloured unless
+# "nocolor" is given. Without it, it goes to LogLines() without colours.
+class Renderer:
+	def __init__(self, options, log = None):
+		self.argv = opts_argv(options) if isinstance(options, dict) else list(options)
+		self.log = log
+		self.glob = self.setup()
+		if self.glob.worker_addr is None and self.glob.batch_file is None:
+			with _api_lock:
+				glob_call(self.glob, check_existance_infile)
+				glob_call(self.glob, segments_from_args)
+	#/def __init__
+
+	# Fresh Globals with the options parsed.
+	def setup(self) -> Globals:
+		g = Globals(log_fn = self.log or LogLines())
+		with _api_lock:
+			try:
+				glob_call(g, parse_cmdline, self.argv)
+			except SystemExit as e:			# argparse error or --help
+				raise AnimPcbError(f"bad options {self.argv}") from e
+		if self.log is None:
+			g.nocolor = True
+		return g
+	#/def setup
+
+	# Frames, poses and kicad-cli arguments of the video, nothing is rendered.
+	def plan(self) -> RenderPlan:
+		with _api_lock:
+			return glob_call(self.glob, plan_frames)
+
+	# Render and encode, or whatever else the options ask for. Raises
+	# AnimPcbError if that failed. plan, e.g. from plan() or plan_load() and
+	# changed by the caller, is rendered instead of the segments of the options.
+	def run(self, plan: RenderPlan = None) -> None:
+		g = self.setup()
+		g.plan_given = plan
+		with _api_lock:
+			glob_call(g, render_main)
+		self.glob = g
+		return
+	#/def run
+
+	# run() as the command line in a process of its own, so that any number of
+	# them can run at once, unlike run(). Its output is passed to log line by line,
+	# plan goes to it as a --plan file.
+	async def run_async(self, plan: RenderPlan = None) -> None:
+		import asyncio, tempfile
+		argv = self.argv + (["-nc"] if self.log is None else [])
+		plan_tmp = None
+		if plan is not None:
+			fd, plan_tmp = tempfile.mkstemp(suffix = ".plan")
+			os.close(fd)
+			plan_save(plan, plan_tmp)
+			argv += ["--plan", plan_tmp]
+		log = self.log or LogLines()
+		tail = collections.deque(maxlen = 20)
+		try:
+			po = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__),
+						*argv, stdin = subprocess.DEVNULL, stdout = subprocess.PIPE,
+						stderr = subprocess.STDOUT)
+			try:
+				async for line in po.stdout:
+					txt = line.decode(errors = "replace")
+					tail.append(txt)
+					log(txt)
+				returncode = await po.wait()
+			except asyncio.CancelledError:
+				po.kill()
+				await po.wait()
+				raise
+		finally:
+			if plan_tmp is not None:
+				os.remove(plan_tmp)
+		if returncode != 0:
+			raise AnimPcbError("".join(tail).strip())
+		return
+# /class Renderer
+
+
+#***** Main ********************************************************************
+
+def main(argv: list = None) -> int:
+	argv = sys.argv[1:] if argv is None else argv
+	if argv[:1] == ["--stand-in"]:
+		if argv[1:2] == ["--serve"]:
+			stand_in_serve()
+		else:
+			stand_in_render(argv[1:])
+		return 0
+
+	# 3.9 for os.waitstatus_to_exitcode() and list[str] annotations.
+	if sys.hexversion < 0x03090000:		# bits 31..24: major, bits 23..16: minor
+		print(term.err + "***ERROR*** Python 3.9 or higher required. \n")
+		return -1
+
+	try:
+		parse_cmdline(argv)		# Returns IFF cmdline args seem mostly ok.
+		render_main()
+	except AnimPcbError as e:
+		print(e)
+		return -1
+	return 0
+#/def main
 
-_LOG(term.title + "\nDone.\n")
 
-sys.exit(0)
+if __name__ == "__main__":
+	sys.exit(main())
 
 # "Emulsified high-fat offal tube"
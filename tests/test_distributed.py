@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Distributed rendering with the stand-in renderer: a --coordinator and two
+# --worker processes, one of which is killed while it has a frame assigned.
+# Its frames must be reassigned to the other worker and all frames arrive.
+
+import os, signal, socket, subprocess, sys, tempfile, time, unittest
+
+ANIM_PCB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "anim_pcb.py")
+FRAMES = 20
+
+
+def free_port() -> int:
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+
+class TestDistributed(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.procs = []
+
+	def tearDown(self):
+		for po in self.procs:
+			if po.poll() is None:
+				po.kill()
+			po.wait()
+			po.stdout.close()
+		self.tmp.cleanup()
+
+	def start(self, *args, **env) -> subprocess.Popen:
+		po = subprocess.Popen([sys.executable, ANIM_PCB, "-nc", *args], cwd = self.tmp.name,
+								env = dict(os.environ, **env), stdin = subprocess.DEVNULL,
+								stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+		self.procs.append(po)
+		return po
+
+	def frame_files(self) -> list:
+		return sorted(fn for fn in os.listdir(os.path.join(self.tmp.name, "coord"))
+						if fn.startswith("board.kicad_pcb.FRAME_") and fn.endswith(".png"))
+
+	def test_lost_worker_frames_reassigned(self):
+		with open(os.path.join(self.tmp.name, "board.kicad_pcb"), "w") as f:
+			f.write("(kicad_pcb)\n")
+		addr = f"127.0.0.1:{free_port()}"
+		coord = self.start("--coordinator", addr, "--cli", "stand-in", "--tmpdir", "coord",
+							"--no-cache", "--worker-timeout", "2", "--retry-backoff", "0",
+							"--in", "board.kicad_pcb", "--res", "16x16", "--fps", "10",
+							"-s", "2s rot(0,0,0) -> rot(0,0,90)")
+		time.sleep(0.5)
+		workers = [self.start("--worker", addr, "--cli", "stand-in", "--tmpdir", f"w{n}",
+								"-j", "1", "--worker-timeout", "2", ANIM_PCB_STAND_IN_SEC = "0.3")
+					for n in (1, 2)]
+
+		deadline = time.monotonic() + 30			# Let the first worker get going.
+		while len(self.frame_files()) < 2 and time.monotonic() < deadline:
+			time.sleep(0.05)
+		workers[0].send_signal(signal.SIGKILL)
+
+		out = coord.communicate(timeout = 60)[0].decode(errors = "replace")
+		self.assertEqual(coord.returncode, 0, out)
+		self.assertIn("lost, retrying", out)			# An assigned frame went back.
+		self.assertEqual(len(self.frame_files()), FRAMES, out)
+		self.assertEqual(workers[1].wait(timeout = 30), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
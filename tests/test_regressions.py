@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Whole runs with the stand-in renderer, behind a wrapper that logs each render
+# and fails the pose rot(60,0,0) while a file FAIL exists:
+#	- batch jobs with the same board and poses render each pose once into the
+#	  shared cache, even when they run at the same time
+#	- a frame filled in by --fill-failed is rendered again by the next run
+
+import json, os, stat, subprocess, sys, tempfile, unittest
+
+ANIM_PCB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "anim_pcb.py")
+SEGMENT = "1s rot(0,0,0) -> rot(90,0,0)"		# At 4 fps frame 2 is rot(60,0,0).
+
+CLI = f"""#!/bin/sh
+case "$*" in *--output*) echo "$*" >> renders.log;; esac
+[ -e FAIL ] && case "$*" in *"'60.00,"*) exit 1;; esac
+exec "{sys.executable}" "{ANIM_PCB}" --stand-in "$@"
+"""
+
+
+class TestRegressions(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.write("board.kicad_pcb", "(kicad_pcb)\n")
+		self.write("cli", CLI)
+		os.chmod(self.path("cli"), stat.S_IRWXU)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def path(self, *names: str) -> str:
+		return os.path.join(self.tmp.name, *names)
+
+	def write(self, filename: str, text: str) -> None:
+		with open(self.path(filename), "w") as f:
+			f.write(text)
+
+	def run_anim_pcb(self, *args) -> str:
+		po = subprocess.run([sys.executable, ANIM_PCB, "-nc", "--cli", "./cli", *args],
+							cwd = self.tmp.name, env = dict(os.environ, ANIM_PCB_STAND_IN_SEC = "0.1"),
+							stdin = subprocess.DEVNULL, stdout = subprocess.PIPE,
+							stderr = subprocess.STDOUT, timeout = 120)
+		out = po.stdout.decode(errors = "replace")
+		self.assertEqual(po.returncode, 0, out)
+		return out
+
+	def renders(self) -> int:
+		if not os.path.exists(self.path("renders.log")):
+			return 0
+		with open(self.path("renders.log")) as f:
+			return len(f.readlines())
+
+	def frame(self, tmpdir: str, n: int) -> bytes:
+		with open(self.path(tmpdir, f"board.kicad_pcb.FRAME_{n:06d}.png"), "rb") as f:
+			return f.read()
+
+	def test_batch_same_cache_key(self):
+		self.write("jobs.json", json.dumps({
+			"defaults": {"in": "board.kicad_pcb", "res": "16x16", "fps": 10, "segment": [SEGMENT]},
+			"jobs": [{"tmpdir": "a"}, {"tmpdir": "b"}]}))
+		out = self.run_anim_pcb("-j", "4", "--cache-dir", "cache", "--batch", "jobs.json")
+		self.assertEqual(self.renders(), 10, out)
+		for n in range(10):
+			self.assertEqual(self.frame("a", n), self.frame("b", n))
+
+	def test_filled_frame_rendered_again(self):
+		args = ("--tmpdir", "f", "--no-cache", "--resume", "--fill-failed", "--retries", "0",
+				"--in", "board.kicad_pcb", "--res", "16x16", "--fps", "4", "-s", SEGMENT)
+		self.write("FAIL", "")
+		out = self.run_anim_pcb(*args)
+		self.assertIn("frame 2 filled with frame 1", out)
+		self.assertEqual(self.frame("f", 2), self.frame("f", 1))
+
+		os.remove(self.path("FAIL"))
+		rendered = self.renders()
+		out = self.run_anim_pcb(*args)
+		self.assertEqual(self.renders(), rendered + 1, out)		# Only the filled frame.
+		self.assertNotEqual(self.frame("f", 2), self.frame("f", 1))
+		self.assertFalse(os.path.exists(self.path("f", "board.kicad_pcb.FRAME_filled.json")))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# Functions of anim_pcb.py on their own, each with its own Globals: the frame
+# poses, the plan file, the render order, cost prediction, image checks, the
+# encode chunks and the quarantine key.
+
+import array, os, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import anim_pcb
+
+
+class GlobTestCase(unittest.TestCase):
+	def setUp(self):
+		self.g = anim_pcb.Globals(nocolor = True, log_fn = lambda txt: None)
+		self.prev = anim_pcb.glob_switch(self.g)
+
+	def tearDown(self):
+		anim_pcb.glob_switch(self.prev)
+
+	def job(self, frame: int) -> anim_pcb.FrameJob:
+		return anim_pcb.FrameJob(frame, [frame], f"{frame}.partial", f"{frame}")
+
+	def popped(self) -> list:
+		return [self.g.todo.pop().frames[0] for _ in range(len(self.g.todo))]
+
+
+class TestFrameTable(unittest.TestCase):
+	def segments(self, *segment_args, fps = 4) -> list:
+		return anim_pcb.parse_segments(list(segment_args), fps = fps, log = lambda txt: None)
+
+	def test_segment_ends_on_toward_pose(self):
+		table = anim_pcb.frame_table(self.segments("1s rot(0,0,0) -> rot(0,0,90)"))
+		self.assertEqual(list(table.cols["rotaz"]), [0, 30, 60, 90])
+		self.assertEqual(list(table.seg_index), [0, 0, 0, 0])
+
+	def test_shared_pose_rendered_once(self):
+		table = anim_pcb.frame_table(self.segments("1s rot(0,0,0) -> rot(0,0,90)",
+													"1s rot(0,0,90) -> rot(0,0,180)"))
+		self.assertEqual(list(table.cols["rotaz"]), [0, 22.5, 45, 67.5, 90, 120, 150, 180])
+		self.assertEqual(list(table.seg_index), [0, 0, 0, 0, 1, 1, 1, 1])
+
+	def test_ease_curve(self):
+		inout = anim_pcb.EASE_CURVES["inout"]
+		self.assertAlmostEqual(anim_pcb.ease_bezier(inout, 0), 0)
+		self.assertAlmostEqual(anim_pcb.ease_bezier(inout, 0.5), 0.5)
+		self.assertAlmostEqual(anim_pcb.ease_bezier(inout, 1), 1)
+		self.assertLess(anim_pcb.ease_bezier(inout, 0.25), 0.25)
+		self.assertGreater(anim_pcb.ease_bezier(inout, 0.75), 0.75)
+
+	def test_eased_segment(self):
+		col = anim_pcb.frame_table(self.segments("1s ease(inout) rot(0,0,0) -> rot(0,0,100)",
+													fps = 11)).cols["rotaz"]
+		self.assertEqual((col[0], col[-1]), (0, 100))
+		self.assertAlmostEqual(col[5], 50)
+		self.assertLess(col[2], 20)
+		self.assertEqual(list(col), sorted(col))
+
+
+class TestPlanFile(GlobTestCase):
+	def test_round_trip(self):
+		self.g.segments = anim_pcb.parse_segments(
+			["1s rot(0,0,0) -> rot(0,0,90)", "1s pan(0,0,0) -> pan(1,0,0)"],
+			fps = 10, log = lambda txt: None)
+		self.g.vid_fps, self.g.vid_dx, self.g.vid_dy = 10, 32, 24
+		self.g.kc_background, self.g.kc_preset, self.g.kc_quality = "default", "p", "basic"
+		plan = anim_pcb.plan_frames()
+		with tempfile.TemporaryDirectory() as tmp:
+			filename = os.path.join(tmp, "video.plan")
+			anim_pcb.plan_save(plan, filename)
+			loaded = anim_pcb.plan_load(filename)
+		self.assertEqual(len(loaded), len(plan))
+		self.assertEqual(loaded.fps, plan.fps)
+		self.assertEqual(loaded.seg_incl, plan.seg_incl)
+		for name in ("rows", "seg_index", "group", "keys"):
+			self.assertEqual(getattr(loaded, name), getattr(plan, name), name)
+		self.assertEqual(loaded.table.seg_index, plan.table.seg_index)
+		self.assertEqual(loaded.table.cols, plan.table.cols)
+		loaded.static = plan.static
+		self.assertEqual([loaded.argv(f) for f in range(len(plan))],
+						[plan.argv(f) for f in range(len(plan))])
+
+	def test_not_a_plan(self):
+		with tempfile.TemporaryDirectory() as tmp:
+			filename = os.path.join(tmp, "video.plan")
+			with open(filename, "wb") as f:
+				f.write(b"not a plan")
+			with self.assertRaises(anim_pcb.AnimPcbError):
+				anim_pcb.plan_load(filename)
+
+
+class TestOrderTodo(GlobTestCase):
+	def test_sequential(self):
+		self.g.order = "sequential"
+		self.g.todo = [self.job(f) for f in (3, 0, 2, 1)]
+		anim_pcb.order_todo()
+		self.assertEqual(self.popped(), [0, 1, 2, 3])
+
+	def test_interleave(self):
+		self.g.order, self.g.order_step = "interleave", 4
+		self.g.todo = [self.job(f) for f in range(9)]
+		anim_pcb.order_todo()
+		self.assertEqual(self.popped(), [0, 4, 8, 2, 6, 1, 3, 5, 7])
+
+	def test_segment(self):
+		self.g.order = "segment"
+		self.g.plan = anim_pcb.RenderPlan(seg_index = array.array("i", [0, 0, 0, 1, 1, 1, 1]))
+		self.g.todo = [self.job(f) for f in range(7)]
+		anim_pcb.order_todo()
+		self.assertEqual(self.popped(), [0, 3, 1, 4, 2, 5, 6])
+
+
+class TestCostPredict(GlobTestCase):
+	def test_no_costs(self):
+		self.assertIsNone(anim_pcb.cost_predict(5))
+
+	def test_predict(self):
+		self.g.cost_idx, self.g.cost_sec = [2, 6], [1.0, 3.0]
+		self.assertEqual(anim_pcb.cost_predict(2), 1.0)
+		self.assertEqual(anim_pcb.cost_predict(6), 3.0)
+		self.assertEqual(anim_pcb.cost_predict(4), 2.0)	# Between two, interpolated.
+		self.assertEqual(anim_pcb.cost_predict(0), 1.0)	# Outside, the nearest.
+		self.assertEqual(anim_pcb.cost_predict(9), 3.0)
+
+
+class TestImageComplete(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def file(self, data: bytes) -> str:
+		filename = os.path.join(self.tmp.name, "image")
+		with open(filename, "wb") as f:
+			f.write(data)
+		return filename
+
+	def test_png(self):
+		png = anim_pcb.png_bytes(4, 4, b"\x10\x20\x30")
+		self.assertTrue(anim_pcb.image_complete(self.file(png)))
+		self.assertFalse(anim_pcb.image_complete(self.file(png[:-1])))
+		self.assertFalse(anim_pcb.image_complete(self.file(png[:20])))
+
+	def test_jpeg(self):
+		self.assertTrue(anim_pcb.image_complete(self.file(b"\xff\xd8" + bytes(100) + b"\xff\xd9")))
+		self.assertFalse(anim_pcb.image_complete(self.file(b"\xff\xd8" + bytes(100))))
+
+	def test_other(self):
+		self.assertFalse(anim_pcb.image_complete(self.file(b"")))
+		self.assertFalse(anim_pcb.image_complete(self.file(b"GIF89a" + bytes(100))))
+		self.assertFalse(anim_pcb.image_complete(os.path.join(self.tmp.name, "missing")))
+
+
+class TestEncChunks(GlobTestCase):
+	def test_parts(self):
+		self.g.vid_frames = 10
+		for n, chunks in (("1", [(0, 10)]), ("3", [(0, 3), (3, 3), (6, 4)]),
+							("20", [(f, 1) for f in range(10)])):
+			self.g.enc_chunks = n
+			self.assertEqual(anim_pcb.enc_chunks(), chunks, n)
+
+	def test_segments(self):
+		self.g.enc_chunks, self.g.vid_frames = "segments", 6
+		self.g.plan = anim_pcb.RenderPlan(seg_index = array.array("i", [0, 0, 1, 1, 1, 2]))
+		self.assertEqual(anim_pcb.enc_chunks(), [(0, 2), (2, 3), (5, 1)])
+
+
+class TestQuarantineKey(GlobTestCase):
+	def test_key(self):
+		self.g.pcb_hash, self.g.kicad_cli_ver = "board", "9.0.0"
+		args = ["pcb", "render", "--rotate", "'60.00,0.00,0.00'"]
+		key = anim_pcb.quarantine_key(args)
+		self.assertEqual(anim_pcb.quarantine_key(list(args)), key)
+		self.assertNotEqual(anim_pcb.quarantine_key(args[:-1] + ["'61.00,0.00,0.00'"]), key)
+		self.assertNotEqual(anim_pcb.quarantine_key(["ab", "c"]), anim_pcb.quarantine_key(["a", "bc"]))
+
+		self.g.kicad_cli_ver = "9.0.1"					# A new kicad-cli may not fail.
+		self.assertNotEqual(anim_pcb.quarantine_key(args), key)
+		self.g.kicad_cli_ver, self.g.pcb_hash = "9.0.0", "other board"
+		self.assertNotEqual(anim_pcb.quarantine_key(args), key)
+
+
+if __name__ == "__main__":
+	unittest.main()